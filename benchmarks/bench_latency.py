@@ -0,0 +1,284 @@
+"""
+@description: End-to-end latency and throughput benchmark of 'face_server' (app_fastapi.py) and
+'face_moods' (audioServer.py) running with hardware stand-ins: a fake loopback device replaying
+a WAV file, the fake TTS backend, the null audio output and simulated faces (WebSocket clients).
+
+It reports p50/p99 of play-to-first-frame latency, mood-command latency, capture-to-face frame
+age, frame interval/jitter, broadcast fan-out time, audio server CPU time per frame and DSP cost
+per chunk as JSON, to compare releases.
+
+@requirements: ffmpeg, and ports 8760/9021 free (the services MUST NOT be running).
+
+@usage: python3 benchmarks/bench_latency.py --clients 50 --output bench.json
+"""
+
+import os
+import sys
+import json
+import time
+import wave
+import asyncio
+import argparse
+import platform
+import tempfile
+import subprocess
+import urllib.request
+import numpy as np
+import websockets
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "face_moods"))
+from wire_format import decode_binary
+FACE_WS = "ws://localhost:8760"
+API = "http://localhost:9021/v1/"
+SAMPLE_RATE = 44100
+CLIP_NAME = "Neutral_benchmark"
+TALKING_LEVEL = 0.1 # Same threshold as face.html
+
+
+# ----- STATISTICS -----
+def summary(values_ms):
+    if not values_ms:
+        return {"n": 0}
+    values = np.asarray(values_ms, dtype=float)
+    return {
+        "n": int(values.size),
+        "p50": round(float(np.percentile(values, 50)), 3),
+        "p99": round(float(np.percentile(values, 99)), 3),
+        "mean": round(float(values.mean()), 3),
+        "max": round(float(values.max()), 3),
+    }
+
+def cpu_seconds(pid):
+    """User + system CPU time of a process (Linux /proc)."""
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+# ----- HARDWARE STAND-INS -----
+def write_loopback_wav(path_file, seconds, speech):
+    """WAV replayed by the fake loopback: a syllable-modulated 200 Hz tone, or silence."""
+    t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    samples = 0.5 * np.sin(2 * np.pi * 200 * t) * np.abs(np.sin(2 * np.pi * 4 * t)) if speech else 0 * t
+    with wave.open(path_file, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(SAMPLE_RATE)
+        wav.writeframes((samples * 32767).astype(np.int16).tobytes())
+
+def start_audio_server(wav_file, log, *options):
+    return subprocess.Popen([sys.executable, "audioServer.py", "--loopback-wav", wav_file, *options],
+                            cwd=os.path.join(ROOT, "face_moods"), stdout=log, stderr=subprocess.STDOUT)
+
+def start_face_server(log):
+    env = dict(os.environ, ROBOT_FACE_TTS="fake", ROBOT_FACE_FAKE_TTS_LATENCY="0", ROBOT_FACE_PLAYBACK="null")
+    return subprocess.Popen([sys.executable, "-m", "uvicorn", "app_fastapi:app", "--port", "9021"],
+                            cwd=os.path.join(ROOT, "face_server"), env=env, stdout=log, stderr=subprocess.STDOUT)
+
+
+# ----- CLIENTS -----
+def http(method, path, body=None):
+    data = json.dumps(body).encode() if body is not None else None
+    request = urllib.request.Request(API + path, data=data, method=method, headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(request, timeout=10) as response:
+        return json.loads(response.read() or "null")
+
+async def wait_ready(timeout=30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            await asyncio.to_thread(http, "GET", "moods")
+            async with websockets.connect(FACE_WS):
+                return
+        except Exception:
+            await asyncio.sleep(0.2)
+    raise RuntimeError("Services not ready")
+
+class Face:
+    """Simulated face: receives binary audio frames and JSON moods, with arrival times."""
+
+    def __init__(self):
+        self.frames = [] # (arrival time, sequence, level, capture time) on the monotonic clock
+        self.moods = []  # (arrival time, mood)
+        self.task = None
+
+    async def run(self):
+        async with websockets.connect(FACE_WS, max_queue=None) as websocket:
+            await websocket.send(json.dumps({"type": "hello", "format": "binary"}))
+            async for message in websocket:
+                now = time.monotonic()
+                if isinstance(message, bytes):
+                    seq, time_ms, levels = decode_binary(message)
+                    # Same host: the server monotonic clock is ours (ms mod 2**32 unwrapped around now)
+                    capture_time = now - ((int(now * 1000) - time_ms) % 2**32) / 1000
+                    self.frames.append((now, seq, levels["bass"], capture_time))
+                else:
+                    data = json.loads(message)
+                    if data.get("type") == "mood":
+                        self.moods.append((now, data["mood"]))
+
+async def audio_server_stats():
+    """DSP cost per chunk and frame counters reported by the audio server."""
+    async with websockets.connect(FACE_WS) as websocket:
+        await websocket.send(json.dumps({"type": "hello", "role": "control"}))
+        await websocket.send(json.dumps({"type": "stats"}))
+        async for message in websocket:
+            if isinstance(message, str) and json.loads(message).get("type") == "stats":
+                return json.loads(message)
+
+async def connect_faces(n):
+    faces = [Face() for _ in range(n)]
+    for face in faces:
+        face.task = asyncio.create_task(face.run())
+    await asyncio.sleep(1.0)
+    return faces
+
+async def disconnect_faces(faces):
+    for face in faces:
+        face.task.cancel()
+    await asyncio.gather(*(face.task for face in faces), return_exceptions=True)
+
+
+# ----- SCENARIOS -----
+async def bench_moods(faces, iterations):
+    """REST mood command -> mood message received by the first and by every face."""
+    first, last = [], []
+    for i in range(iterations):
+        mood = ("Feliz", "Triste")[i % 2]
+        seen = [len(face.moods) for face in faces]
+        start = time.monotonic()
+        await asyncio.to_thread(http, "POST", f"moods/{mood}")
+        while any(len(face.moods) == count for face, count in zip(faces, seen)):
+            await asyncio.sleep(0.0005)
+            if time.monotonic() - start > 2.0:
+                break
+        arrivals = [face.moods[count][0] for face, count in zip(faces, seen) if len(face.moods) > count]
+        if arrivals:
+            first.append((min(arrivals) - start) * 1000)
+            last.append((max(arrivals) - start) * 1000)
+    return {"first_face_ms": summary(first), "all_faces_ms": summary(last)}
+
+async def bench_play(face, iterations):
+    """GET /v1/play -> first audio frame of the clip (level above the talking threshold) at a face."""
+    latencies = []
+    for _ in range(iterations):
+        count = len(face.frames)
+        start = time.monotonic()
+        await asyncio.to_thread(http, "GET", f"play/{CLIP_NAME}")
+        while time.monotonic() - start < 2.0:
+            talking = [frame for frame in face.frames[count:] if frame[2] > TALKING_LEVEL]
+            if talking:
+                latencies.append((talking[0][0] - start) * 1000)
+                break
+            await asyncio.sleep(0.0005)
+        await asyncio.to_thread(http, "GET", "audio/stop")
+        await asyncio.sleep(0.3)
+    return {"play_to_first_frame_ms": summary(latencies)}
+
+async def bench_streaming(faces, seconds, audio_server_pid):
+    """Frame interval/jitter, fan-out spread and audio server CPU per frame while audio streams."""
+    for face in faces:
+        face.frames.clear()
+    cpu_start = cpu_seconds(audio_server_pid)
+    await asyncio.sleep(seconds)
+    cpu = cpu_seconds(audio_server_pid) - cpu_start
+
+    intervals, jitter, ages = [], [], []
+    arrivals = {} # sequence -> arrival times at every face
+    for face in faces:
+        ages.extend((arrival - capture_time) * 1000 for arrival, _, _, capture_time in face.frames)
+        times = np.array([frame[0] for frame in face.frames])
+        if times.size > 2:
+            face_intervals = np.diff(times) * 1000
+            intervals.extend(face_intervals.tolist())
+            jitter.append(float(np.std(face_intervals)))
+        for arrival, seq, _, _ in face.frames:
+            arrivals.setdefault(seq, []).append(arrival)
+    complete = [times for times in arrivals.values() if len(times) == len(faces)]
+    fanout = [(max(times) - min(times)) * 1000 for times in complete]
+    frames = len(arrivals)
+    return {
+        "frames": frames,
+        "frame_rate": round(frames / seconds, 2),
+        "capture_to_face_ms": summary(ages),
+        "frame_interval_ms": summary(intervals),
+        "frame_jitter_ms": summary(jitter),
+        "fanout_ms": summary(fanout),
+        "frames_received_by_all": len(complete),
+        "cpu_per_frame_ms": round(cpu / frames * 1000, 4) if frames else None,
+    }
+
+
+# ----- MAIN -----
+async def run(args, workdir):
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "revision": subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                                       capture_output=True, text=True).stdout.strip(),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "clients": args.clients,
+        }
+    }
+    silence_wav, speech_wav = os.path.join(workdir, "silence.wav"), os.path.join(workdir, "speech.wav")
+    write_loopback_wav(silence_wav, 2.0, speech=False)
+    write_loopback_wav(speech_wav, 2.0, speech=True)
+    log_file = os.path.join(workdir, "services.log")
+    log = open(log_file, "w")
+
+    face_server = start_face_server(log)
+    audio_server = start_audio_server(silence_wav, log)
+    try:
+        await wait_ready()
+        # --- Silent loopback: only the played clip moves the mouth ---
+        await asyncio.to_thread(http, "POST", "audio", {"Mood": "Neutral", "Name": "benchmark", "Text": "Hola, esta es una prueba de latencia."})
+        await asyncio.sleep(3.0) # PCM sidecar built in background
+        faces = await connect_faces(args.clients)
+        report.update(await bench_moods(faces, args.iterations))
+        report.update(await bench_play(faces[0], args.iterations))
+        await disconnect_faces(faces)
+
+        # --- Speech loopback: continuous streaming to every face (every frame sent, no delta gating) ---
+        audio_server.terminate()
+        audio_server.wait()
+        audio_server = start_audio_server(speech_wav, log, "--frame-delta", "0")
+        await wait_ready()
+        faces = await connect_faces(args.clients)
+        report["streaming"] = await bench_streaming(faces, args.seconds, audio_server.pid)
+        report["streaming"]["dsp"] = (await audio_server_stats())["dsp"]
+        await disconnect_faces(faces)
+
+        await asyncio.to_thread(http, "DELETE", "audio", {"Name": CLIP_NAME})
+    except Exception:
+        log.flush()
+        with open(log_file) as f:
+            print(f.read(), file=sys.stderr) # Output of the services, to see why they failed
+        raise
+    finally:
+        for process in (face_server, audio_server):
+            process.terminate()
+            process.wait()
+        log.close()
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description="robot_face end-to-end benchmark")
+    parser.add_argument("--clients", type=int, default=50, help="simulated faces")
+    parser.add_argument("--iterations", type=int, default=30, help="mood commands and plays measured")
+    parser.add_argument("--seconds", type=float, default=10.0, help="duration of the streaming measurement")
+    parser.add_argument("--output", help="JSON report file (stdout if omitted)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="robot_face_bench_") as workdir:
+        report = asyncio.run(run(args, workdir))
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as out:
+            out.write(text + "\n")
+    print(text)
+
+if __name__ == "__main__":
+    main()
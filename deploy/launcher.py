@@ -0,0 +1,164 @@
+#!/usr/bin/python3
+
+"""
+@description: Starts the robot face services in parallel, waits on their readiness probes
+instead of fixed sleeps, and restarts any service that exits (with a growing delay).
+
+    face_server  python3 app_fastapi.py    ready when GET http://localhost:9021/health answers
+    face_moods   python3 audioServer.py    ready when it answers {"type": "health"} on ws://localhost:8760
+    face         chromium kiosk (--face)   started once face_moods is ready
+
+With --embedded the face hub runs inside face_server (ROBOT_FACE_HUB=embedded) and face_moods
+is not started. Ctrl+C or SIGTERM stops every service.
+
+@usage: python3 deploy/launcher.py --face 1920,0
+"""
+
+import os
+import sys
+import json
+import time
+import signal
+import asyncio
+import argparse
+import urllib.request
+import websockets
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+API_HEALTH = "http://localhost:9021/health"
+FACE_WS = "ws://localhost:8760"
+
+
+# ----- READINESS PROBES -----
+def _get(url):
+    with urllib.request.urlopen(url, timeout=1) as response:
+        return response.status == 200
+
+async def api_ready():
+    try:
+        return await asyncio.to_thread(_get, API_HEALTH)
+    except OSError:
+        return False
+
+async def _hub_health():
+    async with websockets.connect(FACE_WS, open_timeout=1, close_timeout=0.2) as websocket:
+        await websocket.send(json.dumps({"type": "hello", "role": "control"})) # Not counted as a face
+        await websocket.send(json.dumps({"type": "health"}))
+        async for message in websocket:
+            if isinstance(message, str) and json.loads(message).get("type") == "health":
+                return True
+    return False
+
+async def hub_ready():
+    try:
+        return await asyncio.wait_for(_hub_health(), 2)
+    except (OSError, asyncio.TimeoutError, websockets.exceptions.WebSocketException):
+        return False
+
+async def all_ready(*probes):
+    for probe in probes:
+        if not await probe():
+            return False
+    return True
+
+
+# ----- SERVICE -----
+class Service:
+    """A child process, its readiness probe and the services it waits for."""
+
+    def __init__(self, name, cmd, cwd, env=None, probe=None, after=(), ready_timeout=60.0):
+        self.name = name
+        self.cmd = cmd
+        self.cwd = cwd
+        self.env = env
+        self.probe = probe # Coroutine returning True once the service answers (None: ready when started)
+        self.after = after # Services that must be ready before this one starts
+        self.ready_timeout = ready_timeout # Seconds without readiness before the service is restarted
+        self.ready = asyncio.Event()
+        self.process = None
+        self.restarts = 0
+
+    async def run(self, min_delay=1.0, max_delay=30.0, stable_after=60.0):
+        """Starts the service, and restarts it whenever it exits or never becomes ready."""
+        delay = min_delay
+        for dependency in self.after:
+            await dependency.ready.wait()
+        while True:
+            started = time.monotonic()
+            self.process = await asyncio.create_subprocess_exec(*self.cmd, cwd=self.cwd, env=self.env)
+            print(f"[launcher] {self.name} started (pid {self.process.pid})", flush=True)
+            await self._wait_ready(started)
+            code = await self.process.wait()
+            self.ready.clear()
+            uptime = time.monotonic() - started
+            if uptime >= stable_after: # It ran fine for a while, this is a fresh crash
+                delay = min_delay
+            self.restarts += 1
+            print(f"[launcher] {self.name} exited with code {code} after {uptime:.1f} s, restarting in {delay:.0f} s", flush=True)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, max_delay)
+
+    async def _wait_ready(self, started):
+        while self.process.returncode is None:
+            if self.probe is None or await self.probe():
+                self.ready.set()
+                print(f"[launcher] {self.name} ready in {time.monotonic() - started:.2f} s", flush=True)
+                return
+            if time.monotonic() - started > self.ready_timeout:
+                print(f"[launcher] {self.name} not ready after {self.ready_timeout:.0f} s, restarting it", flush=True)
+                self.stop()
+                return
+            await asyncio.sleep(0.1)
+
+    def stop(self):
+        if self.process is not None and self.process.returncode is None:
+            self.process.terminate()
+
+
+# ----- MAIN -----
+def build_services(args):
+    python = sys.executable
+    api_env = dict(os.environ)
+    services = []
+    if args.embedded:
+        api_env["ROBOT_FACE_HUB"] = "embedded"
+        api = Service("face_server", [python, "app_fastapi.py"], os.path.join(ROOT, "face_server"), api_env,
+                      probe=lambda: all_ready(api_ready, hub_ready))
+        hub = api
+        services.append(api)
+    else:
+        api = Service("face_server", [python, "app_fastapi.py"], os.path.join(ROOT, "face_server"), api_env, probe=api_ready)
+        hub = Service("face_moods", [python, "audioServer.py"], os.path.join(ROOT, "face_moods"), probe=hub_ready)
+        services += [api, hub]
+    if args.face:
+        services.append(Service("face", [args.browser, "--kiosk", f"--window-position={args.face}", "face.html"],
+                                os.path.join(ROOT, "face_moods"), after=(hub,)))
+    return services
+
+async def main(args):
+    services = build_services(args)
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signal_number in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signal_number, stopping.set)
+
+    tasks = [asyncio.create_task(service.run()) for service in services]
+    await stopping.wait()
+    print("[launcher] Stopping the services", flush=True)
+    for task in tasks:
+        task.cancel()
+    for service in services:
+        service.stop()
+    for service in services:
+        if service.process is not None:
+            try:
+                await asyncio.wait_for(service.process.wait(), 5)
+            except asyncio.TimeoutError:
+                service.process.kill()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Robot face services launcher")
+    parser.add_argument("--embedded", action="store_true", help="run the face hub inside face_server (single process)")
+    parser.add_argument("--face", metavar="X,Y", help="open face.html in a kiosk browser at this screen position (see xrandr)")
+    parser.add_argument("--browser", default="chromium-browser", help="browser command used by --face")
+    asyncio.run(main(parser.parse_args()))
@@ -2,15 +2,26 @@
 """
 @description: WebSocket server that captures system audio (loopback), processes it with FFT 
 to get bass levels, and broadcasts the data to all clients. It also relays 'mood' commands 
-and handles enabling/disabling the audio stream.
+and handles enabling/disabling the audio stream. Frames are only sent when the level moves;
+after sustained silence the server goes idle and only sends sparse keepalives.
+With --relay it runs as a relay of another audio server instead (see relay.py).
 """
 
 import asyncio
 import json
+import time
+import http
+import argparse
 import websockets
-import soundcard as sc
 import numpy as np
 from collections import deque
+from audio_capture import CaptureThread, WavLoopback
+from dsp import DspPipeline
+from metrics import Registry
+from diagnostics import FlightRecorder, SamplingProfiler
+from client_channel import ClientChannel
+from wire_format import AudioFrame, FORMATS
+from relay import UpstreamLink
 
 # ----- CONFIGURATION & GLOBALS -----
 # Central list of all valid moods, synchronized with the HTML file
@@ -20,10 +31,25 @@ AVAILABLE_MOODS = (
     'Preocupado', 'Dudoso', 'Inocente', 'Guiñando', 'Enamorado', 'Decepcionado'
 )
 
-# --- Use a set to track all active clients ---
+# --- Use a set to track the channels of all active clients ---
 ACTIVE_CLIENTS = set()
+# Control clients (hello with "role": "control", e.g. the face_server link): they send commands and
+# only receive the mood echoes, so they neither get audio frames nor keep the analysis running
+CONTROL_CLIENTS = set()
 # Flag state variables
 is_audio_enabled = True
+# Sequence number of the last audio frame
+frame_seq = 0
+# Last broadcast level and when it was sent (frame gating)
+last_sent_level = None
+last_sent_time = 0.0
+# Precomputed envelope of the clip being played by face_server (None = live loopback analysis)
+active_envelope = None
+
+
+# --- Server address (--host/--port) ---
+serverAddress = "localhost"
+serverPort = 8760
 
 
 # --- Audio settings ---
@@ -33,76 +59,359 @@ chunkSize = 1024
 bassRangeStart, bassRangeEnd = 160, 255
 midRangeStart, midRangeEnd = 251, 2000
 highRangeStart, highRangeEnd = 2001, 6000
+captureRingChunks = 8 # Chunks kept by the capture ring buffer
+
+# --- Frame gating & idle mode ---
+frameDelta = 0.01        # Minimum level change to send a new frame
+silenceThreshold = 0.001 # Chunk RMS below this is silence (about -60 dBFS)
+idleAfter = 2.0          # Seconds of silence before going idle (no FFT, no frames)
+keepaliveInterval = 5.0  # Seconds between frames repeating an unchanged level (0 = never)
+
+# --- DSP pipeline (see dsp.py) ---
+dspWindow = "hann"   # "hann" or "none"
+dspAgc = True        # Automatic gain control
+dspAttack = 0.01     # Seconds, mouth opening
+dspRelease = 0.12    # Seconds, mouth closing
+dspBudget = 0.2      # CPU budget per chunk, fraction of the chunk duration
+
+# --- Diagnostics (see diagnostics.py) ---
+frameBudget = 0.02              # Seconds; a slower frame dumps the flight recorder
+flightRecordDir = "flight_records"
+profileMaxSeconds = 60          # Longest profile a client can request
+
+# Capture thread, DSP pipeline and flight recorder, created at startup by mainAsync
+capture = None
+dsp = None
+recorder = None
+# Link to the hub when running as a relay (--relay), None when this server analyses the audio
+upstream = None
+# Sampling profiler running on demand ({"type": "profile"}), None when idle
+profiler = None
+
+
+# ----- METRICS (see metrics.py) -----
+metrics = Registry("face_audio_")
+capture_age = metrics.histogram("capture_age_seconds", "Age of a loopback chunk when the event loop reads it")
+fft_time = metrics.histogram("fft_seconds", "DSP time per chunk (window, FFT, bands, AGC, smoothing)")
+serialize_time = metrics.histogram("serialize_seconds", "Encoding time of an audio frame, for every wire format in use")
+broadcast_time = metrics.histogram("broadcast_seconds", "Time to queue an audio frame for every client")
+frames_sent = metrics.counter("frames_total", "Audio frames broadcast")
+connections = metrics.counter("connections_total", "WebSocket connections accepted (reconnections included)")
+recent_frames = deque(maxlen=64) # Send times of the last frames (frame rate)
+
+def frame_rate():
+    """Frames per second over the last frames (0 if none was sent during the last second)."""
+    if len(recent_frames) < 2 or time.monotonic() - recent_frames[-1] > 1.0:
+        return 0.0
+    return round((len(recent_frames) - 1) / max(recent_frames[-1] - recent_frames[0], 1e-6), 2)
+
+def client_label(channel):
+    host, port = channel.websocket.remote_address[:2]
+    return {"client": f"{host}:{port}"}
+
+metrics.gauge("frame_rate", "Audio frames per second over the last frames", frame_rate)
+metrics.gauge("clients", "Connected clients", lambda: len(ACTIVE_CLIENTS))
+metrics.gauge("client_queue_depth", "Messages waiting to be sent, per client",
+              lambda: [(client_label(channel), channel.depth) for channel in ACTIVE_CLIENTS])
+metrics.gauge("client_coalesced_frames", "Audio frames replaced by a newer one before being sent, per client",
+              lambda: [(client_label(channel), channel.coalesced) for channel in ACTIVE_CLIENTS])
+metrics.gauge("skipped_chunks", "Captured chunks overwritten before being analysed", lambda: capture.skipped if capture else 0)
+metrics.gauge("gated_chunks", "Silent chunks not analysed while idle", lambda: capture.gated if capture else 0)
+metrics.gauge("dsp_over_budget_chunks", "Chunks whose DSP time exceeded the budget", lambda: dsp.over_budget if dsp else 0)
+metrics.gauge("slow_frames", "Frames whose stages exceeded the frame budget", lambda: recorder.slow_frames if recorder else 0)
 
 
 # ----- WEBSOCKET BROADCASTERS -----
 # *** Broadcast to All Clients ***
-async def broadcast(message):
-    """Sends a message to all connected clients."""
-    if ACTIVE_CLIENTS:
-        tasks = [client.send(message) for client in ACTIVE_CLIENTS]
-        await asyncio.gather(*tasks, return_exceptions=True)
+async def broadcast(message, droppable=False):
+    """
+    Queues a message for all connected clients, without waiting for the sends.
+    Droppable (audio) messages replace any audio frame a slow client has not received yet.
+    """
+    for client in ACTIVE_CLIENTS:
+        client.push(message, droppable)
 
 # *** Send Mood Command ***
 async def send_mood(mood_name):
     """Broadcasts a mood command to all clients."""
     payload = json.dumps({"type": "mood", "mood": mood_name})
     await broadcast(payload)
+    for client in CONTROL_CLIENTS: # Echo, e.g. for the mood round trip of face_server
+        client.push(payload)
+
+# *** Send Audio Frame ***
+async def send_audio_frame(bass, force=False, capture_time=None, **bands):
+    """
+    Broadcasts an audio frame, serialized once per wire format and shared by all clients.
+    Unless forced, it is skipped when the level did not move past 'frameDelta' (the return to
+    silence and keepalives are always sent). Other band levels ('mid', 'high') follow the bass.
+    'capture_time' is the monotonic time of the audio described (now by default).
+    Returns True if the frame was sent (only those get a sequence number and a recorder row).
+    """
+    global frame_seq, last_sent_level, last_sent_time
+    now = asyncio.get_running_loop().time()
+    if not force and last_sent_level is not None:
+        changed = abs(bass - last_sent_level) >= frameDelta or (bass == 0.0 and last_sent_level != 0.0)
+        keepalive_due = keepaliveInterval and now - last_sent_time >= keepaliveInterval
+        if not changed and not keepalive_due:
+            return False
+    last_sent_level, last_sent_time = bass, now
+    frame_seq += 1
+    await publish_frame(AudioFrame(frame_seq, {"bass": bass, **bands}, now if capture_time is None else capture_time))
+    return True
+
+# *** Publish Audio Frame ***
+async def publish_frame(frame):
+    """Serializes a frame once per wire format in use and queues it for every client."""
+    start = time.perf_counter()
+    for wire_format in {client.wire_format for client in ACTIVE_CLIENTS}:
+        frame.encode(wire_format) # Cached in the frame, the writers reuse it
+    encoded = time.perf_counter()
+    await broadcast(frame, droppable=True)
+    sent = time.perf_counter()
+    serialize_time.observe(encoded - start)
+    broadcast_time.observe(sent - encoded)
+    recorder.stage("serialize", encoded - start)
+    recorder.stage("broadcast", sent - encoded)
+    frames_sent.inc()
+    recent_frames.append(time.monotonic())
 
 # *** Send Audio Off Signal ***
 async def send_audio_off_signal():
     """Broadcasts a reset audio signal to all clients."""
-    payload = json.dumps({"type": "audio", "bass": 0})
-    await broadcast(payload)
+    await send_audio_frame(0.0, force=True)
 
 
 # ----- AUDIO ENGINE -----
+# *** Start Streaming a Precomputed Envelope ***
+def start_envelope(levels, hop, delay=0.0, offset=0.0):
+    """
+    Replaces the live analysis with the envelope of the clip that face_server is playing,
+    starting 'offset' seconds into the clip, 'delay' seconds from now.
+    """
+    global active_envelope
+    loop = asyncio.get_running_loop()
+    active_envelope = {
+        "levels": np.asarray(levels, dtype=np.float32) / 255.0,
+        "hop": float(hop),
+        "start": loop.time() + float(delay) - float(offset), # Time when the first sample is heard
+    }
+    if capture is not None:
+        capture.interrupt() # Wakes the loopback analysis up if it is idle
+    print(f"<-- Streaming envelope ({len(levels)} frames).")
+
+# *** Stream the Active Envelope ***
+async def stream_envelope():
+    """Broadcasts the envelope values aligned to playback start, until the clip ends."""
+    global active_envelope
+    loop = asyncio.get_running_loop()
+    while active_envelope is not None and is_audio_enabled and ACTIVE_CLIENTS:
+        envelope = active_envelope
+        elapsed = loop.time() - envelope["start"]
+        if elapsed < 0: # Playback did not start yet
+            await asyncio.sleep(-elapsed)
+            continue
+
+        index = int(elapsed / envelope["hop"])
+        if index >= len(envelope["levels"]): # End of the clip
+            active_envelope = None
+            await send_audio_off_signal()
+            break
+
+        # Stamped with the time its audio is heard
+        if await send_audio_frame(float(envelope["levels"][index]), capture_time=envelope["start"] + index * envelope["hop"]):
+            recorder.commit(frame_seq)
+        # Wake up at the start of the next envelope frame (the lateness is the next frame's overshoot)
+        wake_at = envelope["start"] + (index + 1) * envelope["hop"]
+        await asyncio.sleep(wake_at - loop.time())
+        recorder.stage("overshoot", max(loop.time() - wake_at, 0.0))
+
+# *** Open the Loopback Recorder ***
+def open_loopback():
+    """Captures the audio's output (loopback). Called from the capture thread."""
+    import soundcard as sc # Imported here, so the server can run with a fake loopback without a sound card
+    return sc.get_microphone(
+        id=str(sc.default_speaker().name),
+        include_loopback=True
+    ).recorder(samplerate=sampleRate, channels=1)
+
 # *** Process and Broadcast Audio FFT Data ***
+async def process_loopback():
+    """
+    Live loopback analysis, used while no precomputed envelope is being streamed.
+    After 'idleAfter' seconds of silence it goes idle: silent chunks no longer wake it up
+    (see CaptureThread) and it only sends keepalives, until a louder chunk arrives.
+    """
+    chunk = np.zeros(chunkSize, dtype=np.float32)
+    dsp.reset()
+    loop = asyncio.get_running_loop()
+    silent_since = None
+    try:
+        # The capture is paused while an envelope is streamed, so no stale audio is buffered
+        while active_envelope is None:
+            # If the audio is disabled or no clients are connected
+            if not is_audio_enabled or not ACTIVE_CLIENTS:
+                capture.pause()
+                await asyncio.sleep(0.1)
+                continue
+            
+            # Newest chunk written by the capture thread (does not block the event loop)
+            capture.resume()
+            timeout = keepaliveInterval if capture.idle and keepaliveInterval else None
+            if await capture.read_chunk(chunk, timeout) is None: # Keepalive time or interrupted
+                if capture.idle:
+                    await send_audio_frame(0.0)
+                continue
+            age = loop.time() - capture.chunk_time
+            capture_age.observe(age)
+            recorder.stage("capture_age", age)
+
+            # --- Silence detection (idle mode) ---
+            if np.sqrt(np.mean(np.square(chunk))) < silenceThreshold:
+                silent_since = silent_since or loop.time()
+                if capture.idle:
+                    continue
+                if loop.time() - silent_since >= idleAfter:
+                    capture.idle = True
+                    dsp.reset()
+                    await send_audio_frame(0.0)
+                    continue
+            else:
+                silent_since = None
+                capture.idle = False
+
+            # --- FFT band levels (window, AGC, smoothing: see dsp.py) ---
+            start = time.perf_counter()
+            levels = dsp.process(chunk)
+            fft_time.observe(time.perf_counter() - start)
+            recorder.stage("fft", dsp.fft_time)
+            recorder.stage("smoothing", dsp.post_time)
+            
+            # Broadcast the audio data (JSON or binary, depending on each client), if it moved
+            if await send_audio_frame(capture_time=capture.chunk_time, **levels):
+                recorder.commit(frame_seq)
+    finally:
+        capture.pause()
+        capture.idle = False
+
+# *** Relay a Hub Frame ***
+async def relay_frame(frame):
+    """
+    Republishes a frame received from the hub (None: the hub is gone, mouths are closed).
+    Frames are renumbered with the relay's own sequence: if the hub restarts, its numbering
+    starts over, and the faces of the relay would drop every frame as reordered.
+    """
+    global frame_seq
+    loop = asyncio.get_running_loop()
+    if frame is None:
+        frame = AudioFrame(0, {}, loop.time())
+    frame_seq += 1
+    frame.seq = frame_seq & 0xFFFF # Not encoded yet
+    if not ACTIVE_CLIENTS:
+        return
+    recorder.stage("capture_age", max(loop.time() - frame.time, 0.0)) # Hub capture to relay, clocks synced
+    await publish_frame(frame)
+    recorder.commit(frame_seq)
+
+# *** Relay a Hub Broadcast ***
+async def relay_control(message):
+    await broadcast(message)
+
+# *** Audio Task ***
 async def process_audio():
     global is_audio_enabled
-    bass_history = deque(maxlen=5) ## Smooths bass values
     try:
-        # Captures the audio's output (loopback)
-        with sc.get_microphone(
-            id=str(sc.default_speaker().name),
-            include_loopback=True
-        ).recorder(samplerate=sampleRate, channels=1) as mic:
-            while True:
-                # If the audio is disabled or no clients are connected
-                if not is_audio_enabled or not ACTIVE_CLIENTS:
-                    await asyncio.sleep(0.1)
-                    continue
-                
-                # Chunk capture
-                data = mic.record(numframes=chunkSize)
-                if data.size == 0: continue
-
-                # --- Fast Fourier Transform Processing ---
-                fftData = np.fft.rfft(data[:, 0])
-                fftFreq = np.fft.rfftfreq(len(data[:, 0]), 1.0 / sampleRate)
-                bassIndices = np.where((fftFreq >= bassRangeStart) & (fftFreq <= bassRangeEnd))
-                bassEnergy = np.mean(np.abs(fftData[bassIndices])) if bassIndices[0].size > 0 else 0
-                normalizedBass = min(bassEnergy / 30.0, 1.0)
-                bass_history.append(normalizedBass)
-                smoothed_bass = np.mean(bass_history)
-                
-                # Broadcast the audio data into a JSON payload
-                payload = json.dumps({"type": "audio", "bass": smoothed_bass})
-                await broadcast(payload)
-                await asyncio.sleep(0.01)
+        while True:
+            # If the audio is disabled or no clients are connected
+            if not is_audio_enabled or not ACTIVE_CLIENTS:
+                await asyncio.sleep(0.1)
+                continue
+
+            if active_envelope is not None:
+                await stream_envelope()
+            else:
+                await process_loopback()
 
     except Exception as e:
         print(f"Audio processing error: {e}. Audio streaming will stop.")
         is_audio_enabled = False
 
 
+# ----- CLIENT STATISTICS -----
+def client_stats():
+    """Per-client send counters and the last lag report, plus an aggregate over all clients."""
+    clients = [dict(channel.stats(), address=str(channel.websocket.remote_address)) for channel in ACTIVE_CLIENTS]
+    reports = [client["lag"] for client in clients if client["lag"]]
+    return {
+        "count": len(clients),
+        "lag_ms_mean": round(float(np.mean([r["lag_ms"]["mean"] for r in reports])), 3) if reports else None,
+        "lag_ms_max": max((r["lag_ms"]["max"] for r in reports), default=None),
+        "dropped": sum(r.get("dropped", 0) for r in reports),
+        "reordered": sum(r.get("reordered", 0) for r in reports),
+        "stale": sum(r.get("stale", 0) for r in reports),
+        "clients": clients,
+    }
+
+
+# ----- PROFILER -----
+def start_profile(channel, seconds):
+    """Starts the sampling profiler; the result is sent to 'channel' when it stops."""
+    global profiler
+    if profiler is not None and profiler.running:
+        channel.push(json.dumps({"type": "profile", "error": "A profile is already running"}))
+        return
+    loop = asyncio.get_running_loop()
+    seconds = min(max(float(seconds), 0.1), profileMaxSeconds)
+    profiler = SamplingProfiler(seconds, on_done=lambda result: loop.call_soon_threadsafe(channel.push, json.dumps(result)))
+    profiler.start()
+    print(f"<-- Profiling for {seconds} s.")
+
+
+# ----- COMMANDS -----
+# *** Apply a Mood/Mouth/Envelope Command ***
+async def apply_command(data):
+    """
+    Applies a command that changes every face. Sent by the clients, or called directly by
+    face_server when the hub runs inside it (see face_server/lib/embedded_hub.py).
+    """
+    global is_audio_enabled, active_envelope
+    command_type = data.get("type")
+
+    if command_type == "mood": # Broadcast a new mood
+        mood = data.get("mood")
+        print(f"Commanded mood: {mood}")
+        if mood in AVAILABLE_MOODS:
+            print(f"<-- Received command: '{mood}'")
+            await send_mood(mood)
+
+    elif command_type == "audio": # Flips the global audio capture flag on or off
+        command = data.get("command")
+        if command == "on" and not is_audio_enabled:
+            is_audio_enabled = True
+            print("<-- Audio streaming ENABLED.")
+        elif command == "off" and is_audio_enabled:
+            is_audio_enabled = False
+            print("<-- Audio streaming DISABLED.")
+            await send_audio_off_signal()
+            capture.interrupt() # Pauses the capture even if the analysis is idle
+
+    elif command_type == "envelope": # Precomputed envelope of a clip played by face_server
+        if data.get("command") == "stop":
+            active_envelope = None
+            await send_audio_off_signal()
+        elif data.get("levels"):
+            start_envelope(data["levels"], data.get("hop", chunkSize / sampleRate),
+                           data.get("delay", 0.0), data.get("offset", 0.0))
+
+
 # ----- WEBSOCKET SERVER HANDLER -----
 # *** Handle Individual Client Connections ***
 async def client_handler(websocket):
-    global is_audio_enabled
-
     print(f"Client connected: {websocket.remote_address}")
-    ACTIVE_CLIENTS.add(websocket) # Adds the new client to the ACTIVE_CLIENTS set
+    channel = ClientChannel(websocket)
+    channel.start()
+    ACTIVE_CLIENTS.add(channel) # Adds the new client to the ACTIVE_CLIENTS set
+    connections.inc()
     try:
         # Explicitly wrap the message loop to catch the expected connection closure exception
         try:
@@ -111,22 +420,53 @@ async def client_handler(websocket):
                     data = json.loads(message)
                     command_type = data.get("type")
 
-                    if command_type == "mood": # Broadcast a new mood
-                        mood = data.get("mood")
-                        print(f"Commanded mood: {mood}")
-                        if mood in AVAILABLE_MOODS:
-                            print(f"<-- Received command: '{mood}'")
-                            await send_mood(mood)
-                    
-                    elif command_type == "audio": # Flips the global audio capture flag on or off
-                        command = data.get("command")
-                        if command == "on" and not is_audio_enabled:
-                            is_audio_enabled = True
-                            print("<-- Audio streaming ENABLED.")
-                        elif command == "off" and is_audio_enabled:
-                            is_audio_enabled = False
-                            print("<-- Audio streaming DISABLED.")
-                            await send_audio_off_signal()
+                    if command_type == "hello": # Protocol negotiation, e.g. {"type": "hello", "format": "binary"}
+                        wire_format = data.get("format")
+                        if wire_format in FORMATS:
+                            channel.wire_format = wire_format
+                            print(f"<-- Client {websocket.remote_address} uses {wire_format} audio frames.")
+                        if data.get("role") == "control" and channel in ACTIVE_CLIENTS: # Not a face
+                            ACTIVE_CLIENTS.remove(channel)
+                            CONTROL_CLIENTS.add(channel)
+                            print(f"<-- Client {websocket.remote_address} is a control client.")
+                            if not ACTIVE_CLIENTS and capture is not None:
+                                capture.interrupt()
+
+                    elif command_type in ("mood", "audio", "envelope"): # Commands that change every face
+                        if upstream is not None:
+                            upstream.push(message) # The hub applies it and broadcasts it to every relay
+                        else:
+                            await apply_command(data)
+
+                    elif command_type == "health": # Readiness probe, e.g. of deploy/launcher.py
+                        channel.push(json.dumps({"type": "health", "status": "ready", "mode": "relay" if upstream else "hub",
+                                                 "audio": is_audio_enabled, "clients": len(ACTIVE_CLIENTS),
+                                                 "upstream": upstream.connected if upstream else None}))
+
+                    elif command_type == "sync": # Clock sync: the client computes its offset from the round trip
+                        channel.push(json.dumps({"type": "sync", "t0": data.get("t0"),
+                                                 "server": asyncio.get_running_loop().time()}))
+
+                    elif command_type == "lag": # Lag/drop report measured by the client
+                        channel.record_report(data)
+
+                    elif command_type == "stats": # Per-chunk DSP cost and per-client lag, e.g. for benchmarks
+                        channel.push(json.dumps({"type": "stats", "dsp": dsp.stats() if dsp else None, "frames": frame_seq,
+                                                 "skipped_chunks": capture.skipped if capture else 0, "clients": client_stats(),
+                                                 "upstream": upstream.stats() if upstream else None,
+                                                 "slow_frames": recorder.slow_frames, "flight_dumps": recorder.dumps,
+                                                 "metrics": metrics.snapshot()}))
+
+                    elif command_type == "profile": # Sampling profiler, e.g. {"type": "profile", "seconds": 5}
+                        if data.get("command") == "stop":
+                            if profiler is not None:
+                                profiler.stop() # The result is sent by the profiler thread
+                        else:
+                            start_profile(channel, data.get("seconds", 5))
+
+                    elif command_type == "flight": # Dumps the flight recorder now, e.g. while reproducing a glitch
+                        recorder.dump("requested by a client")
+                        channel.push(json.dumps({"type": "flight", "frames": recorder.frames()[-50:]}))
 
                 except json.JSONDecodeError:
                     print("Error: Received invalid JSON message.")
@@ -139,29 +479,85 @@ async def client_handler(websocket):
             
      # When the client disconnects or the the loop breaks, it remove the client from the set
     finally:
-        print(f"Client disconnected: {websocket.remote_address}")
-        ACTIVE_CLIENTS.remove(websocket)
+        print(f"Client disconnected: {websocket.remote_address} {channel.stats()}")
+        ACTIVE_CLIENTS.discard(channel)
+        CONTROL_CLIENTS.discard(channel)
+        if not ACTIVE_CLIENTS and capture is not None:
+            capture.interrupt() # No one listens anymore, the capture is paused
+        channel.close()
+
+
 
+# ----- METRICS ENDPOINT -----
+def serve_metrics(connection, request):
+    """Answers a plain HTTP 'GET /metrics' on the WebSocket port (Prometheus scrape)."""
+    if request.path == "/metrics":
+        return connection.respond(http.HTTPStatus.OK, metrics.render())
+    return None # Other paths continue with the WebSocket handshake
 
 
 # ----- SERVER STARTUP -----
 # *** Main Async Function ***
-async def mainAsync():
-    serverAddress = "localhost"
-    serverPort = 8760
+async def mainAsync(loopback_wav=None, relay_url=None, on_listening=None):
+    """Runs the server until cancelled. 'on_listening()' is called once the port is bound (e.g. by embedded_hub)."""
+    global recorder, upstream
     print(f"Starting WebSocket server on ws://{serverAddress}:{serverPort}")
     print("Waiting for client connections...")
+    recorder = FlightRecorder(budget=frameBudget, dump_dir=flightRecordDir)
 
-    # Starts the audio task in the background
-    asyncio.create_task(process_audio())
+    if relay_url: # Relay: frames and moods come from the hub, no capture nor analysis here
+        print(f"Relaying the audio server {relay_url}")
+        upstream = UpstreamLink(relay_url, relay_frame, relay_control)
+        upstream.start()
+    else:
+        start_analysis(loopback_wav)
 
     # Starts the WebSocket server
-    async with websockets.serve(client_handler, serverAddress, serverPort):
+    async with websockets.serve(client_handler, serverAddress, serverPort, process_request=serve_metrics):
+        if on_listening is not None:
+            on_listening()
         await asyncio.Future()
 
+# *** Start the Capture and Analysis ***
+def start_analysis(loopback_wav=None):
+    """Starts the capture thread and the audio task in the background."""
+    global capture, dsp
+    open_recorder = open_loopback
+    if loopback_wav: # Fake loopback device replaying a WAV file (benchmarks, no sound card)
+        wav_loopback = WavLoopback(loopback_wav, sampleRate)
+        open_recorder = lambda: wav_loopback
+        print(f"Fake loopback device: {loopback_wav}")
+    dsp = DspPipeline(
+        sampleRate, chunkSize,
+        bands={"bass": (bassRangeStart, bassRangeEnd), "mid": (midRangeStart, midRangeEnd), "high": (highRangeStart, highRangeEnd)},
+        window=dspWindow, agc=dspAgc, attack=dspAttack, release=dspRelease, budget=dspBudget
+    )
+    capture = CaptureThread(open_recorder, chunkSize, captureRingChunks, silenceThreshold)
+    capture.attach(asyncio.get_running_loop())
+    asyncio.create_task(process_audio())
+
 # *** Entry Point ***
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Face audio WebSocket server")
+    parser.add_argument("--host", default=serverAddress, help="address to listen on (0.0.0.0 for every interface)")
+    parser.add_argument("--port", type=int, default=serverPort, help="port to listen on")
+    parser.add_argument("--relay", metavar="URL", help="run as a relay of the audio server at URL (e.g. ws://hub:8760) instead of capturing")
+    parser.add_argument("--loopback-wav", help="replay this WAV file (16-bit, 44.1 kHz) instead of capturing the sound card")
+    parser.add_argument("--frame-delta", type=float, default=frameDelta, help="minimum level change to send a frame")
+    parser.add_argument("--idle-after", type=float, default=idleAfter, help="seconds of silence before going idle")
+    parser.add_argument("--keepalive", type=float, default=keepaliveInterval, help="seconds between keepalive frames (0 = never)")
+    parser.add_argument("--window", choices=("hann", "none"), default=dspWindow, help="FFT window")
+    parser.add_argument("--no-agc", action="store_true", help="fixed normalization instead of automatic gain control")
+    parser.add_argument("--attack", type=float, default=dspAttack, help="smoothing attack time in seconds (0 = none)")
+    parser.add_argument("--release", type=float, default=dspRelease, help="smoothing release time in seconds (0 = none)")
+    parser.add_argument("--frame-budget", type=float, default=frameBudget * 1000, help="milliseconds; a slower frame dumps the flight recorder")
+    parser.add_argument("--flight-dir", default=flightRecordDir, help="directory of the flight recorder dumps")
+    args = parser.parse_args()
+    frameDelta, idleAfter, keepaliveInterval = args.frame_delta, args.idle_after, args.keepalive
+    dspWindow, dspAgc, dspAttack, dspRelease = args.window, not args.no_agc, args.attack, args.release
+    frameBudget, flightRecordDir = args.frame_budget / 1000, args.flight_dir
+    serverAddress, serverPort = args.host, args.port
     try:
-        asyncio.run(mainAsync())
+        asyncio.run(mainAsync(args.loopback_wav, args.relay))
     except KeyboardInterrupt:
         print("\nServer stopped")
\ No newline at end of file
@@ -0,0 +1,171 @@
+"""
+@description: Dedicated capture thread for the audio server. The blocking soundcard 'record'
+calls run outside the asyncio event loop and write into a preallocated NumPy ring buffer,
+which the async side consumes without blocking. While the server is idle, silent chunks do
+not wake the event loop at all.
+"""
+
+import time
+import wave
+import asyncio
+import threading
+import numpy as np
+
+
+# ----- RING BUFFER -----
+class CaptureRing:
+    """Fixed-size ring of audio chunks, written by the capture thread and read by the event loop."""
+
+    def __init__(self, chunk_size, n_chunks=8):
+        self.buffer = np.zeros((n_chunks, chunk_size), dtype=np.float32)
+        self.times = np.zeros(n_chunks) # Capture time (time.monotonic) of the newest sample of each chunk
+        self.n_chunks = n_chunks
+        self.written = 0 # Total number of chunks written since start
+        self.lock = threading.Lock()
+
+    def write(self, data, capture_time):
+        """Copies a (frames x channels) chunk into the next slot (first channel only)."""
+        with self.lock:
+            self.times[self.written % self.n_chunks] = capture_time
+            slot = self.buffer[self.written % self.n_chunks]
+            frames = min(len(data), len(slot))
+            slot[:frames] = data[:frames, 0]
+            slot[frames:] = 0.0
+            self.written += 1
+
+    def read_latest(self, out):
+        """Copies the newest chunk into 'out'. Returns the total count of chunks written and its capture time."""
+        with self.lock:
+            if not self.written:
+                return 0, 0.0
+            out[:] = self.buffer[(self.written - 1) % self.n_chunks]
+            return self.written, float(self.times[(self.written - 1) % self.n_chunks])
+
+
+# ----- CAPTURE THREAD -----
+class CaptureThread(threading.Thread):
+    """
+    Records 'chunk_size' frames at a time from the recorder returned by 'open_recorder'
+    (a context manager with a 'record(numframes)' method) while capture is active.
+    The recorder is closed while paused, so no stale audio is buffered.
+    While 'idle' is set, chunks whose RMS is below 'silence_threshold' are not signalled to the
+    event loop; the first louder chunk wakes it up.
+    """
+
+    def __init__(self, open_recorder, chunk_size, n_chunks=8, silence_threshold=0.0):
+        super().__init__(name="audio-capture", daemon=True)
+        self.open_recorder = open_recorder
+        self.chunk_size = chunk_size
+        self.ring = CaptureRing(chunk_size, n_chunks)
+        self.active = threading.Event()
+        self.silence_threshold = silence_threshold
+        self.idle = False # Set by the event loop after sustained silence
+        self.error = None
+        self.skipped = 0 # Chunks overwritten before the event loop could read them
+        self.gated = 0   # Silent chunks not signalled while idle
+        self.chunk_time = 0.0 # Capture time of the chunk returned by the last read_chunk
+        self._loop = None
+        self._new_chunk = None
+        self._read_count = 0
+        self._gated_seen = 0
+        self._interrupted = False
+
+    # *** Lifecycle (called from the event loop) ***
+    def attach(self, loop):
+        """Binds the thread to the event loop that consumes the chunks and starts it."""
+        self._loop = loop
+        self._new_chunk = asyncio.Event()
+        self.start()
+
+    def resume(self):
+        self.active.set()
+
+    def pause(self):
+        self.active.clear()
+
+    def interrupt(self):
+        """Makes a pending read_chunk return None (e.g. an envelope starts while idle)."""
+        self._interrupted = True
+        if self._new_chunk is not None:
+            self._new_chunk.set()
+
+    # *** Capture Loop (capture thread) ***
+    def run(self):
+        while True:
+            self.active.wait()
+            try:
+                with self.open_recorder() as mic:
+                    while self.active.is_set():
+                        data = mic.record(numframes=self.chunk_size)
+                        if data.size == 0: continue
+                        self.ring.write(data, time.monotonic())
+                        if self.idle and np.sqrt(np.mean(np.square(data[:, 0]))) < self.silence_threshold:
+                            self.gated += 1
+                            continue
+                        self._loop.call_soon_threadsafe(self._new_chunk.set)
+            except Exception as e:
+                self.error = e
+                self.active.clear()
+                self._loop.call_soon_threadsafe(self._new_chunk.set)
+
+    # *** Chunk Consumer (event loop) ***
+    async def read_chunk(self, out, timeout=None):
+        """
+        Waits without blocking the event loop for a new chunk and copies the newest one into 'out'.
+        Returns None after 'timeout' seconds without a (signalled) chunk or on interrupt().
+        """
+        while True:
+            if self.error is not None:
+                error, self.error = self.error, None
+                raise error
+            if self._interrupted:
+                self._interrupted = False
+                return None
+            written, capture_time = self.ring.read_latest(out)
+            gated = self.gated
+            if written - (gated - self._gated_seen) > self._read_count:
+                self.skipped += max(0, written - self._read_count - 1 - (gated - self._gated_seen))
+                self._read_count = written
+                self._gated_seen = gated
+                self.chunk_time = capture_time
+                return out
+            self._new_chunk.clear()
+            try:
+                await asyncio.wait_for(self._new_chunk.wait(), timeout)
+            except asyncio.TimeoutError:
+                return None
+
+
+# ----- FAKE LOOPBACK (benchmarks / tests without sound card) -----
+class WavLoopback:
+    """
+    Recorder stand-in that replays a 16-bit PCM WAV file in a loop, paced in real time
+    like a sound card (record blocks until the frames would have been captured).
+    """
+
+    def __init__(self, path_file, samplerate):
+        with wave.open(path_file, "rb") as wav:
+            if wav.getsampwidth() != 2 or wav.getframerate() != samplerate:
+                raise ValueError(f"{path_file} must be 16-bit PCM at {samplerate} Hz")
+            raw = np.frombuffer(wav.readframes(wav.getnframes()), dtype=np.int16)
+            channels = wav.getnchannels()
+        self.samples = raw.reshape(-1, channels)[:, 0].astype(np.float32) / 32768.0
+        self.samplerate = samplerate
+        self.position = 0
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.monotonic() - self.position / self.samplerate
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def record(self, numframes):
+        indices = (self.position + np.arange(numframes)) % len(self.samples)
+        self.position += numframes
+        # Wait until the last requested frame would have been played by the sound card
+        delay = self.start + self.position / self.samplerate - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        return self.samples[indices][:, None]
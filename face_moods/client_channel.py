@@ -0,0 +1,88 @@
+"""
+@description: Per-client outbound channel for the audio server. Each face gets a small bounded
+queue served by its own writer task, so a slow client never delays the others: stale 'audio'
+frames are coalesced (only the newest bass value matters) while 'mood' messages are never dropped.
+"""
+
+import asyncio
+from collections import deque
+import websockets
+from wire_format import AudioFrame, FORMAT_JSON
+
+
+# ----- CLIENT CHANNEL -----
+class ClientChannel:
+    """Bounded send queue and lag counters of one connected client."""
+
+    def __init__(self, websocket, max_control=64):
+        self.websocket = websocket
+        self.wire_format = FORMAT_JSON # Negotiated by the client "hello" message
+        self.max_control = max_control # A client that falls this far behind is disconnected
+        self.control = deque()  # Messages that are never dropped (mood, ...)
+        self.audio = None       # Newest pending audio frame (older ones are coalesced)
+        self._wakeup = asyncio.Event()
+        self._writer = None
+
+        # --- Lag counters ---
+        self.sent = 0            # Messages sent to the client
+        self.coalesced = 0       # Audio frames replaced by a newer one before being sent
+        self.max_backlog = 0     # Highest number of control messages waiting at once
+        self.lag_report = None   # Last {"type": "lag"} report sent by the client
+
+    # *** Lifecycle ***
+    def start(self):
+        self._writer = asyncio.create_task(self._write_loop())
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.cancel()
+
+    # *** Enqueue (never blocks) ***
+    def push(self, message, droppable=False):
+        """Queues a message. Droppable (audio) messages replace the pending one instead of queueing."""
+        if droppable:
+            if self.audio is not None:
+                self.coalesced += 1
+            self.audio = message
+        else:
+            if len(self.control) >= self.max_control:
+                print(f"Client {self.websocket.remote_address} is not reading, disconnecting it")
+                asyncio.ensure_future(self.websocket.close())
+                return
+            self.control.append(message)
+            self.max_backlog = max(self.max_backlog, len(self.control))
+        self._wakeup.set()
+
+    @property
+    def depth(self):
+        """Number of messages waiting to be sent."""
+        return len(self.control) + (self.audio is not None)
+
+    def record_report(self, report):
+        """Keeps the lag report of the client if it is well formed."""
+        lag = report.get("lag_ms")
+        if isinstance(lag, dict) and isinstance(lag.get("mean"), (int, float)) and isinstance(lag.get("max"), (int, float)):
+            self.lag_report = {key: report[key] for key in ("frames", "dropped", "reordered", "stale", "lag_ms") if key in report}
+
+    def stats(self):
+        return {"sent": self.sent, "coalesced": self.coalesced, "max_backlog": self.max_backlog, "depth": self.depth,
+                "format": self.wire_format, "lag": self.lag_report}
+
+    # *** Writer Task ***
+    async def _write_loop(self):
+        try:
+            while True:
+                await self._wakeup.wait()
+                self._wakeup.clear()
+                # Control messages first and in order, then only the newest audio frame
+                while self.control or self.audio is not None:
+                    if self.control:
+                        message = self.control.popleft()
+                    else:
+                        message, self.audio = self.audio, None
+                    if isinstance(message, AudioFrame): # Shared frame, encoded once per format
+                        message = message.encode(self.wire_format)
+                    await self.websocket.send(message)
+                    self.sent += 1
+        except websockets.exceptions.ConnectionClosed:
+            pass # The client handler cleans up the disconnected client
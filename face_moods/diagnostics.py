@@ -0,0 +1,169 @@
+"""
+@description: Field diagnostics of the audio server. The flight recorder keeps the stage timings
+of the last frames in a fixed-size ring and dumps it to disk, with a snapshot of the asyncio
+tasks and of the thread stacks, when a frame exceeds its budget. The sampling profiler records
+the stacks of the server threads for a few seconds on demand (WebSocket "profile" command).
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import threading
+import traceback
+from collections import Counter
+import numpy as np
+
+# Timed stages of one frame (seconds), in ring column order
+STAGES = ("capture_age", "fft", "smoothing", "serialize", "broadcast", "overshoot")
+
+
+# ----- SNAPSHOTS -----
+def task_snapshot(limit=8):
+    """Name, coroutine and innermost frames of every asyncio task (call from the event loop)."""
+    tasks = []
+    for task in asyncio.all_tasks():
+        frames = [f"{frame.f_code.co_filename}:{frame.f_lineno} {frame.f_code.co_name}" for frame in task.get_stack(limit=limit)]
+        tasks.append({"name": task.get_name(), "coro": getattr(task.get_coro(), "__qualname__", str(task.get_coro())), "stack": frames})
+    return tasks
+
+def thread_snapshot(limit=8):
+    """Innermost frames of every thread (e.g. the capture thread blocked in 'record')."""
+    names = {thread.ident: thread.name for thread in threading.enumerate()}
+    return {
+        names.get(ident, str(ident)): [f"{entry.filename}:{entry.lineno} {entry.name}" for entry in traceback.extract_stack(frame, limit=limit)]
+        for ident, frame in sys._current_frames().items()
+    }
+
+
+# ----- FLIGHT RECORDER -----
+class FlightRecorder:
+    """
+    Ring of the last 'size' frames: time, sequence number and one duration per stage.
+    Stages are set while the frame is processed and the row is written by commit().
+    """
+
+    def __init__(self, size=512, budget=0.02, dump_dir="flight_records", cooldown=10.0, max_dumps=20):
+        self.rows = np.zeros((size, 2 + len(STAGES))) # time, seq, stages...
+        self.size = size
+        self.written = 0
+        self.budget = budget # Seconds; a frame whose stages add up to more triggers a dump
+        self.dump_dir = dump_dir
+        self.cooldown = cooldown # Minimum seconds between two dumps
+        self.max_dumps = max_dumps # Oldest dump files are removed beyond this count
+        self.dumps = 0
+        self.slow_frames = 0
+        self._current = np.zeros(len(STAGES))
+        self._columns = {stage: i for i, stage in enumerate(STAGES)}
+        self._last_dump = -cooldown
+
+    def stage(self, name, seconds):
+        self._current[self._columns[name]] = seconds
+
+    def commit(self, seq):
+        """Writes the current frame into the ring and dumps the ring if the frame was too slow."""
+        row = self.rows[self.written % self.size]
+        row[0] = time.monotonic()
+        row[1] = seq
+        row[2:] = self._current
+        self.written += 1
+        total = float(self._current.sum())
+        self._current[:] = 0.0
+        if total > self.budget:
+            self.slow_frames += 1
+            if row[0] - self._last_dump >= self.cooldown:
+                self._last_dump = row[0]
+                self.dump(f"frame {int(seq)} took {total * 1000:.1f} ms (budget {self.budget * 1000:.1f} ms)")
+
+    def frames(self):
+        """Ring content, oldest first, as a list of dictionaries (times in ms)."""
+        count = min(self.written, self.size)
+        start = self.written - count
+        ordered = self.rows[[(start + i) % self.size for i in range(count)]]
+        return [
+            {"time": round(row[0], 4), "seq": int(row[1]), **{stage: round(value * 1000, 3) for stage, value in zip(STAGES, row[2:])}}
+            for row in ordered
+        ]
+
+    def dump(self, reason):
+        """Snapshots the ring and the tasks on the event loop, and writes the file from a thread."""
+        record = {
+            "reason": reason,
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "frames": self.frames(),
+            "tasks": task_snapshot(),
+            "threads": thread_snapshot(),
+        }
+        self.dumps += 1
+        asyncio.get_running_loop().run_in_executor(None, self._write, record)
+
+    def _write(self, record):
+        try:
+            os.makedirs(self.dump_dir, exist_ok=True)
+            path_file = os.path.join(self.dump_dir, f"flight_{time.strftime('%Y%m%d_%H%M%S')}_{os.getpid()}_{self.dumps}.json")
+            with open(path_file, "w") as out:
+                json.dump(record, out, indent=1)
+            print(f"Slow frame, flight record written to {path_file}: {record['reason']}")
+            dumps = sorted(entry.path for entry in os.scandir(self.dump_dir) if entry.name.startswith("flight_"))
+            for old_file in dumps[:-self.max_dumps]:
+                os.remove(old_file)
+        except OSError as e:
+            print(f"Could not write the flight record: {e}")
+
+
+# ----- SAMPLING PROFILER -----
+class SamplingProfiler:
+    """Samples the stacks of every thread (but its own) every 'interval' seconds, for 'seconds'."""
+
+    def __init__(self, seconds, interval=0.005, on_done=None):
+        self.seconds = seconds
+        self.interval = interval
+        self.on_done = on_done # Called (from the profiler thread) with the result
+        self.samples = 0
+        self.stacks = Counter()    # "thread;outer;...;inner" -> samples
+        self.functions = Counter() # innermost "file:function" -> samples (self time)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    @property
+    def running(self):
+        return self._thread.is_alive()
+
+    def _run(self):
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        own = threading.get_ident()
+        started = time.monotonic()
+        deadline = started + self.seconds
+        while time.monotonic() < deadline and not self._stop.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                frames = []
+                while frame is not None:
+                    frames.append(f"{os.path.basename(frame.f_code.co_filename)}:{frame.f_code.co_name}")
+                    frame = frame.f_back
+                if not frames:
+                    continue
+                thread_name = names.get(ident) or str(ident)
+                self.stacks[";".join([thread_name] + frames[::-1])] += 1
+                self.functions[f"{thread_name} {frames[0]}"] += 1
+            self.samples += 1
+        if self.on_done is not None:
+            self.on_done(self.result(time.monotonic() - started))
+
+    def result(self, duration, top=30):
+        return {
+            "type": "profile",
+            "duration": round(duration, 3),
+            "samples": self.samples,
+            "interval_ms": self.interval * 1000,
+            "top_functions": [{"function": name, "samples": count} for name, count in self.functions.most_common(top)],
+            "top_stacks": [{"stack": stack, "samples": count} for stack, count in self.stacks.most_common(top)],
+        }
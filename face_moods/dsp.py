@@ -0,0 +1,128 @@
+"""
+@description: Audio analysis pipeline of the audio server, built once at startup. The window,
+the band bin ranges and the work buffers are precomputed, and the energy of every band is
+obtained in one vectorized pass. Optional stages: automatic gain control (the mouth reacts
+the same at any system volume) and attack/release smoothing. The CPU time of every chunk is
+measured against a budget.
+"""
+
+import time
+import numpy as np
+
+# Default bands (Hz), 'bass' drives the mouth
+DEFAULT_BANDS = {
+    "bass": (160, 255),
+    "mid": (251, 2000),
+    "high": (2001, 6000),
+}
+
+
+# ----- PIPELINE -----
+class DspPipeline:
+    """
+    Chunk -> [window] -> FFT magnitude -> mean magnitude per band -> / scale -> [AGC] -> clip [0, 1]
+    -> [attack/release smoothing]. Returns a dictionary band -> level.
+    """
+
+    def __init__(self, sample_rate, chunk_size, bands=DEFAULT_BANDS, window="hann", scale=30.0,
+                 agc=True, agc_target=0.9, agc_release=3.0, agc_floor=0.05,
+                 smoothing=True, attack=0.01, release=0.12, budget=0.2):
+        self.sample_rate = sample_rate
+        self.chunk_size = chunk_size
+        self.names = tuple(bands)
+        hop = chunk_size / sample_rate
+
+        # --- Window (its coherent gain is compensated, so 'scale' keeps the unwindowed meaning) ---
+        if window == "hann":
+            self.window = np.hanning(chunk_size).astype(np.float32)
+        else:
+            self.window = None
+        self.scale = scale * (float(self.window.mean()) if self.window is not None else 1.0)
+
+        # --- Band bin ranges, as indices into a cumulative sum of the spectrum ---
+        freqs = np.fft.rfftfreq(chunk_size, 1.0 / sample_rate)
+        self.starts = np.empty(len(bands), dtype=np.intp)
+        self.stops = np.empty(len(bands), dtype=np.intp)
+        for i, (low, high) in enumerate(bands.values()):
+            indices = np.flatnonzero((freqs >= low) & (freqs <= high))
+            self.starts[i], self.stops[i] = (indices[0], indices[-1] + 1) if indices.size else (0, 0)
+        self.counts = np.maximum(self.stops - self.starts, 1).astype(np.float64)
+
+        # --- Preallocated buffers ---
+        self._windowed = np.zeros(chunk_size, dtype=np.float32)
+        self._magnitude = np.zeros(len(freqs), dtype=np.float64)
+        self._cumsum = np.zeros(len(freqs) + 1, dtype=np.float64) # [0] stays 0
+        self._levels = np.zeros(len(bands), dtype=np.float64)
+
+        # --- Automatic gain control: peak follower that decays over 'agc_release' seconds ---
+        self.agc = agc
+        self.agc_target = agc_target
+        self.agc_floor = agc_floor # Peaks below this are noise, not amplified to a full mouth
+        self.agc_decay = float(np.exp(-hop / agc_release))
+        self._peak = np.full(len(bands), agc_floor)
+
+        # --- Attack/release smoothing (one-pole filter, fast opening, slower closing) ---
+        self.smoothing = smoothing
+        self.attack_coef = float(np.exp(-hop / attack)) if attack > 0 else 0.0
+        self.release_coef = float(np.exp(-hop / release)) if release > 0 else 0.0
+        self._state = np.zeros(len(bands), dtype=np.float64)
+
+        # --- CPU budget (fraction of the chunk duration) ---
+        self.budget = budget * hop
+        self.chunks = 0
+        self.over_budget = 0
+        self.cost_total = 0.0
+        self.cost_max = 0.0
+        self.fft_time = 0.0  # Wall time of the last chunk: window + FFT + band energies
+        self.post_time = 0.0 # AGC, clipping and smoothing
+
+    def reset(self):
+        """Clears the smoothing state (e.g. after silence or an envelope)."""
+        self._state[:] = 0.0
+
+    def process(self, chunk):
+        start = time.thread_time()
+        wall_start = time.perf_counter()
+
+        if self.window is not None:
+            np.multiply(chunk, self.window, out=self._windowed)
+            spectrum = np.fft.rfft(self._windowed)
+        else:
+            spectrum = np.fft.rfft(chunk)
+        np.abs(spectrum, out=self._magnitude)
+        np.cumsum(self._magnitude, out=self._cumsum[1:])
+        levels = self._levels
+        np.subtract(self._cumsum[self.stops], self._cumsum[self.starts], out=levels)
+        levels /= self.counts * self.scale
+        wall_fft = time.perf_counter()
+
+        if self.agc:
+            np.maximum(levels, self._peak * self.agc_decay, out=self._peak)
+            np.maximum(self._peak, self.agc_floor, out=self._peak)
+            levels *= self.agc_target / self._peak
+        np.clip(levels, 0.0, 1.0, out=levels)
+
+        if self.smoothing:
+            coef = np.where(levels > self._state, self.attack_coef, self.release_coef)
+            self._state += (1.0 - coef) * (levels - self._state)
+            levels = self._state
+
+        cost = time.thread_time() - start
+        self.fft_time = wall_fft - wall_start
+        self.post_time = time.perf_counter() - wall_fft
+        self.chunks += 1
+        self.cost_total += cost
+        self.cost_max = max(self.cost_max, cost)
+        if cost > self.budget:
+            self.over_budget += 1
+        return {name: float(level) for name, level in zip(self.names, levels)}
+
+    def stats(self):
+        """CPU time per chunk in milliseconds, and how many chunks exceeded the budget."""
+        return {
+            "chunks": self.chunks,
+            "budget_ms": round(self.budget * 1000, 3),
+            "mean_ms": round(self.cost_total / self.chunks * 1000, 4) if self.chunks else None,
+            "max_ms": round(self.cost_max * 1000, 4),
+            "over_budget": self.over_budget,
+        }
@@ -0,0 +1,139 @@
+"""
+@description: Minimal metrics registry (counters, gauges and histograms), rendered in the
+Prometheus text format. The audio server serves it at http://localhost:8760/metrics and returns
+it for the {"type": "stats"} message; face_server imports this module for its GET /metrics.
+face_server updates its metrics from worker and player threads, so each metric has a lock; in the
+audio loop it is never contended and an observation stays a bisect and two additions.
+"""
+
+import threading
+from bisect import bisect_left
+
+# Upper bounds (s) of the default histogram buckets, from 10 us to 1 s
+TIME_BUCKETS = (0.00001, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+
+# ----- METRIC TYPES -----
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help_text):
+        self.name, self.help = name, help_text
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def samples(self):
+        return [({}, self.value)]
+
+
+class Gauge:
+    """Value read when the metrics are rendered: 'fn' returns a number or a list of (labels, value)."""
+    kind = "gauge"
+
+    def __init__(self, name, help_text, fn):
+        self.name, self.help = name, help_text
+        self.fn = fn
+
+    def samples(self):
+        value = self.fn()
+        return value if isinstance(value, list) else [({}, value)]
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help_text, buckets=TIME_BUCKETS):
+        self.name, self.help = name, help_text
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1) # Last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def read(self):
+        """Consistent copy (counts, sum, count), since other threads may be observing."""
+        with self._lock:
+            return list(self.counts), self.sum, self.count
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-quantile (None if empty)."""
+        counts, _, count = self.read()
+        if not count:
+            return None
+        rank, total = q * count, 0
+        for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+            total += bucket_count
+            if total >= rank:
+                return bound
+
+
+# ----- REGISTRY -----
+class Registry:
+    def __init__(self, prefix, buckets=TIME_BUCKETS):
+        self.prefix = prefix
+        self.buckets = buckets # Default histogram buckets of this registry
+        self.metrics = []
+
+    def _add(self, metric):
+        metric.name = self.prefix + metric.name
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text):
+        return self._add(Counter(name, help_text))
+
+    def gauge(self, name, help_text, fn):
+        return self._add(Gauge(name, help_text, fn))
+
+    def histogram(self, name, help_text, buckets=None):
+        return self._add(Histogram(name, help_text, buckets or self.buckets))
+
+    def render(self):
+        """Prometheus text exposition format (version 0.0.4)."""
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            if metric.kind == "histogram":
+                counts, total_sum, count = metric.read()
+                total = 0
+                for bound, bucket_count in zip(metric.buckets + (float("inf"),), counts):
+                    total += bucket_count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f'{metric.name}_bucket{{le="{le}"}} {total}')
+                lines.append(f"{metric.name}_sum {total_sum}")
+                lines.append(f"{metric.name}_count {count}")
+                continue
+            for labels, value in metric.samples():
+                label_text = ",".join(f'{key}="{value_}"' for key, value_ in labels.items())
+                lines.append(f"{metric.name}{{{label_text}}} {value}" if labels else f"{metric.name} {value}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        """Compact dictionary of the values (histograms as count, mean and p50/p99 bucket bounds)."""
+        values = {}
+        for metric in self.metrics:
+            if metric.kind == "histogram":
+                _, total_sum, count = metric.read()
+                values[metric.name] = {
+                    "count": count,
+                    "mean": total_sum / count if count else None,
+                    "p50": metric.quantile(0.5),
+                    "p99": metric.quantile(0.99),
+                }
+            else:
+                samples = metric.samples()
+                values[metric.name] = samples[0][1] if len(samples) == 1 and not samples[0][0] else \
+                    [dict(labels, value=value) for labels, value in samples]
+        return values
@@ -0,0 +1,128 @@
+"""
+@description: Upstream link of an audio server running as a relay (--relay ws://host:port).
+The relay does no capture nor analysis: it receives the frames of the hub (the one audio server
+that analyses the loopback) and republishes each of them once to its local clients. Commands
+of the local clients (mood, audio on/off, envelopes) are forwarded to the hub, which broadcasts
+them back to every relay. Capture times are converted to the relay clock (clock sync).
+"""
+
+import json
+import asyncio
+from collections import deque
+import websockets
+from client_channel import ClientChannel
+from wire_format import AudioFrame, BANDS
+
+
+# ----- UPSTREAM LINK -----
+class UpstreamLink:
+    """
+    Persistent connection to the hub, reconnected with a growing delay.
+    The coroutines 'on_frame(frame)' and 'on_control(text)' get the audio frames (AudioFrame,
+    relay clock) and the other broadcast messages (mood, ...) as received.
+    """
+
+    def __init__(self, url, on_frame, on_control, sync_interval=10.0, reconnect_delay=0.5, max_reconnect_delay=10.0):
+        self.url = url
+        self.on_frame = on_frame
+        self.on_control = on_control
+        self.sync_interval = sync_interval
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.channel = None               # ClientChannel of the hub connection while connected
+        self.pending = deque(maxlen=32)   # Commands sent while disconnected, flushed on connect
+        self.syncs = deque(maxlen=8)      # Last (round trip, offset) clock sync samples
+        # Hub clock minus relay clock (s); 0 until synced, which is exact on the same host
+        self.offset = 0.0
+        self.frames = 0
+        self.reconnects = 0
+        self._task = None
+
+    # *** Lifecycle ***
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    @property
+    def connected(self):
+        return self.channel is not None
+
+    # *** Commands to the Hub ***
+    def push(self, message):
+        """Forwards a command to the hub (queued while disconnected)."""
+        if self.channel is not None:
+            self.channel.push(message)
+        else:
+            self.pending.append(message)
+
+    # *** Clock Sync ***
+    def _send_sync(self):
+        self.push(json.dumps({"type": "sync", "t0": asyncio.get_running_loop().time()}))
+
+    def _on_sync(self, data):
+        t1 = asyncio.get_running_loop().time()
+        t0, server = data.get("t0"), data.get("server")
+        if not isinstance(t0, (int, float)) or not isinstance(server, (int, float)):
+            return
+        self.syncs.append((t1 - t0, server - (t0 + t1) / 2))
+        self.offset = min(self.syncs)[1] # Sample with the shortest round trip
+
+    async def _sync_loop(self):
+        for _ in range(3): # A few quick samples first, then a periodic refresh
+            self._send_sync()
+            await asyncio.sleep(0.2)
+        while True:
+            await asyncio.sleep(self.sync_interval)
+            self._send_sync()
+
+    # *** Connection ***
+    async def _run(self):
+        delay = self.reconnect_delay
+        while True:
+            try:
+                async with websockets.connect(self.url, close_timeout=1) as websocket:
+                    print(f"Relay connected to the hub {self.url}")
+                    delay = self.reconnect_delay
+                    self.channel = ClientChannel(websocket)
+                    self.channel.start()
+                    while self.pending:
+                        self.channel.push(self.pending.popleft())
+                    sync_task = asyncio.create_task(self._sync_loop())
+                    try:
+                        async for message in websocket:
+                            await self._dispatch(message)
+                    finally:
+                        sync_task.cancel()
+                        self.channel.close()
+                        self.channel = None
+            except (OSError, websockets.exceptions.WebSocketException) as e:
+                print(f"Relay cannot reach the hub {self.url}: {e}")
+            self.reconnects += 1
+            await self.on_frame(None) # Closes the mouths while the hub is away
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.max_reconnect_delay)
+
+    async def _dispatch(self, message):
+        try:
+            data = json.loads(message)
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            print("Relay: invalid message from the hub")
+            return
+        message_type = data.get("type")
+        if message_type == "audio":
+            self.frames += 1
+            levels = {band: float(data.get(band, 0.0)) for band in BANDS}
+            await self.on_frame(AudioFrame(data.get("seq", 0), levels, data.get("t", 0.0) - self.offset))
+        elif message_type == "sync":
+            self._on_sync(data)
+        elif message_type == "mood":
+            await self.on_control(message)
+
+    def stats(self):
+        return {
+            "url": self.url,
+            "connected": self.connected,
+            "offset_ms": round(self.offset * 1000, 3),
+            "rtt_ms": round(min(self.syncs)[0] * 1000, 3) if self.syncs else None,
+            "frames": self.frames,
+            "reconnects": self.reconnects,
+        }
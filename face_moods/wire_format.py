@@ -0,0 +1,67 @@
+"""
+@description: Wire formats of the audio frames sent by the audio server. Each frame is
+serialized at most once per format and the same bytes/string are shared by all clients.
+
+Binary audio frame (little endian), for clients that sent {"type": "hello", "format": "binary"}:
+    byte 0      frame type (FRAME_AUDIO)
+    bytes 1-2   sequence number (uint16, wraps around)
+    bytes 3-6   capture time, server monotonic clock in ms (uint32, wraps around)
+    bytes 7..   one uint8 level (0-255) per band, in BANDS order
+
+JSON audio frame: {"type": "audio", "seq": 12, "t": 5123.456 (capture time, s), "bass": 0.4, ...}
+"""
+
+import json
+import struct
+
+FRAME_AUDIO = 1
+HEADER = struct.Struct('<BHI')
+BANDS = ('bass', 'mid', 'high') # Band order of the binary levels
+
+FORMAT_JSON = "json"
+FORMAT_BINARY = "binary"
+FORMATS = (FORMAT_JSON, FORMAT_BINARY)
+
+
+# ----- QUANTIZATION -----
+def quantize(level):
+    """Maps a [0, 1] level to a uint8."""
+    return int(min(max(level, 0.0), 1.0) * 255 + 0.5)
+
+
+# ----- AUDIO FRAME -----
+class AudioFrame:
+    """One audio frame, with its JSON and binary encodings built lazily and cached."""
+
+    __slots__ = ("seq", "levels", "time", "_text", "_binary")
+
+    def __init__(self, seq, levels, capture_time):
+        self.seq = seq & 0xFFFF
+        self.levels = levels # Dictionary band -> level [0, 1] (missing bands are 0)
+        self.time = capture_time # Server monotonic time (s) of the audio the levels describe
+        self._text = None
+        self._binary = None
+
+    @property
+    def text(self):
+        if self._text is None:
+            self._text = json.dumps({"type": "audio", "seq": self.seq, "t": round(self.time, 4),
+                                     **{band: float(self.levels.get(band, 0.0)) for band in BANDS}})
+        return self._text
+
+    @property
+    def binary(self):
+        if self._binary is None:
+            header = HEADER.pack(FRAME_AUDIO, self.seq, int(self.time * 1000) & 0xFFFFFFFF)
+            self._binary = header + bytes(quantize(self.levels.get(band, 0.0)) for band in BANDS)
+        return self._binary
+
+    def encode(self, wire_format):
+        return self.binary if wire_format == FORMAT_BINARY else self.text
+
+def decode_binary(data):
+    """Returns (sequence, capture time in ms mod 2**32, levels) of a binary audio frame."""
+    frame_type, seq, time_ms = HEADER.unpack_from(data)
+    if frame_type != FRAME_AUDIO:
+        raise ValueError(f"Unknown frame type {frame_type}")
+    return seq, time_ms, {band: level / 255 for band, level in zip(BANDS, data[HEADER.size:])}
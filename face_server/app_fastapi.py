@@ -7,11 +7,23 @@ audio files from a static directory.
 """
 
 import os
-from fastapi import FastAPI, APIRouter, Body
+import argparse
+from contextlib import asynccontextmanager
+from typing import Optional
+from fastapi import FastAPI, APIRouter, Body, Query, Request, Response
+from fastapi.responses import JSONResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 import lib.soundmood_control as smc
 import lib.t2s as t2s
+import lib.pcm_store as pcm_store
+import lib.catalog as catalog
+import lib.batch_jobs as batch_jobs
+import lib.speak as speak
+import lib.scheduler as scheduler
+import lib.timeline as timeline
+import lib.loudness as loudness
+import lib.metrics as metrics
 import uvicorn
 
 # --- CONFIGURATION & APP INITIALIZATION ---
@@ -19,10 +31,26 @@ static_dir = os.path.abspath('lib/audios')
 vAPI = "/v1" # Used as the APIRouter prefix
 
 
+# --- Lifespan ---
+# Keeps a persistent connection to the face websocket server while the app is running,
+# converts the library clips that have no decoded PCM sidecar yet (background thread)
+# loads the audio catalog (with its watcher and test-audio cleanup) and analyses the loudness
+# of the clips that are new or changed since the last run (process pool)
+@asynccontextmanager
+async def lifespan(app):
+    smc.face_link.start()
+    pcm_store.store.start()
+    catalog.store.start()
+    loudness.job.start()
+    yield
+    await smc.face_link.stop()
+
+
 # --- FastAPI Initialization ---
 app = FastAPI(
     title="Robot audios server",
-    description="Robot audios backend using FastAPI."
+    description="Robot audios backend using FastAPI.",
+    lifespan=lifespan
 )
 
 # --- CORS Middlewares ---
@@ -54,6 +82,24 @@ async def post_audio(data: dict = Body(..., description="JSON payload for audio
     """
     return smc.post_audio(data)
 
+# *** Create Audios in Bulk ***
+@router.post('/audio/batch')
+async def post_audio_batch(data: dict = Body(..., description="JSON payload with the list of audios to create.")):
+    """
+    Start a background job that creates many audio files, returns its job id.
+
+    body = {"Items": [{"Mood": "Feliz", "Name": "hola", "Text": "hola"}, ...], "Concurrency": 4}
+    """
+    return batch_jobs.start_job(data)
+
+# *** Bulk Creation Status ***
+@router.get('/audio/batch/{job_id}')
+def get_audio_batch(job_id: str):
+    """
+    Progress and per-item results of a bulk creation job.
+    """
+    return batch_jobs.get_job(job_id)
+
 # *** Delete Audio ***
 @router.delete('/audio')
 async def delete_audio(data: dict = Body(..., description="JSON payload for audio deletion.")):
@@ -66,8 +112,41 @@ async def delete_audio(data: dict = Body(..., description="JSON payload for audi
 
 # *** Get/List Audios ***
 @router.get('/audio')
-def get_audios():
-    return smc.get_audios()
+def get_audios(request: Request, mood: Optional[str] = None, prefix: Optional[str] = None,
+               offset: int = Query(0, ge=0), limit: Optional[int] = Query(None, ge=1)):
+    """
+    List audio files with their metadata, optionally filtered by mood and name prefix, and paginated.
+    The total count is in the 'X-Total-Count' header. Send back the 'ETag' as 'If-None-Match'
+    to get an empty '304 Not Modified' while the library does not change.
+    """
+    etag = f'W/"{catalog.store.boot}-{catalog.store.version}-{mood}-{prefix}-{offset}-{limit}"'
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+
+    audios, total = smc.get_audios(mood, prefix, offset, limit)
+    return JSONResponse(audios, headers={"ETag": etag, "X-Total-Count": str(total)})
+
+# *** Loudness Reindex ***
+@router.post('/audio/loudness')
+def post_audio_loudness(data: dict = Body({}, description="JSON payload with the reindex options.")):
+    """
+    Start a background job that analyses the loudness of the library clips (one process per core)
+    and stores the gain applied when they play. Only new or changed clips unless "Force".
+
+    body = {"Force": false, "Workers": 4}
+    """
+    workers = data.get("Workers")
+    if workers is not None and (not isinstance(workers, int) or workers < 1):
+        return {"Status": False, "Description": "'Workers' must be an integer >= 1"}
+    return loudness.job.start(bool(data.get("Force", False)), workers)
+
+# *** Loudness Reindex Status ***
+@router.get('/audio/loudness')
+def get_audio_loudness():
+    """
+    Progress of the last loudness reindex.
+    """
+    return loudness.job.status()
 
 
 # ----- AUDIO PLAYBACK ENDPOINTS -----
@@ -77,13 +156,101 @@ def play(audio_file: str):
     mood = audio_file.split('_')[0]
     if not mood == "":
         smc.set_mood(mood)
-    return t2s.playAudio(audio_file)
+    # The envelope is streamed once the first sample is about to be heard
+    return t2s.playAudio(audio_file, on_start=lambda delay: smc.play_envelope(audio_file, delay))
+
+# *** Speak Text (streaming) ***
+@router.post('/speak')
+def speak_text(data: dict = Body(..., description="JSON payload with the text to speak.")):
+    """
+    Speak a text without creating an audio file. Playback starts with the first sentence
+    while the next ones are still being synthesized.
+
+    body = {"Text": "Hola. ¿Cómo estás?", "Mood": "Feliz"}
+    """
+    return speak.speak(data)
+
+# *** Playback Queue ***
+@router.post('/queue')
+def queue_audio(data: dict = Body(..., description="JSON payload with the audio to queue.")):
+    """
+    Queue a library audio. It plays right after the previous items without gaps; a higher
+    priority (or "Urgent") preempts the item playing. The mood is set when the item starts.
+
+    body = {"Audio": "Feliz_hola", "Mood": "Feliz", "Priority": 0, "Urgent": false}
+    """
+    return scheduler.queue.submit(data)
+
+@router.get('/queue')
+def queue_status():
+    """
+    Item playing (with its position/duration in seconds) and queued items, in playing order.
+    """
+    return scheduler.queue.status()
+
+@router.delete('/queue/{item_id}')
+def cancel_queued(item_id: str):
+    """
+    Cancel a queued item by id, or skip it if it is playing.
+    """
+    return scheduler.queue.cancel(item_id)
+
+# *** Timed Choreography ***
+@router.post('/timeline')
+def post_timeline(data: dict = Body(..., description="JSON payload with the timestamped actions.")):
+    """
+    Validate and run a timeline of actions at their time (seconds from the start), returns its id.
+    Actions: mood (Mood), mouth (State on/off), play (library Audio), volume (Value 0-100).
+
+    body = {"Actions": [{"At": 0, "Action": "mood", "Mood": "Feliz"}, {"At": 0.5, "Action": "play", "Audio": "Feliz_Saludo"}],
+            "Loop": false, "Period": 5.0, "Delay": 0}
+    """
+    return timeline.start_timeline(data)
+
+@router.get('/timeline/{timeline_id}')
+def get_timeline(timeline_id: str):
+    """
+    State, iteration, executed actions and timing error (ms) of a timeline.
+    """
+    return timeline.get_timeline(timeline_id)
+
+@router.delete('/timeline/{timeline_id}')
+def cancel_timeline(timeline_id: str, stop: bool = False):
+    """
+    Cancel a timeline; with ?stop=true the clip it is playing is stopped too.
+    """
+    return timeline.cancel_timeline(timeline_id, stop)
 
 # *** Stop Audio Playback ***
 @router.get('/audio/stop')
 def stop():
+    speak.cancel()
+    smc.stop_envelope()
     return t2s.stop()
 
+# *** Pause Audio Playback ***
+@router.get('/audio/pause')
+def pause():
+    smc.stop_envelope()
+    return t2s.pause()
+
+# *** Resume Audio Playback ***
+@router.get('/audio/resume')
+def resume():
+    paused = t2s.status()
+    response = t2s.resume()
+    if paused.get("audio"): # Continue the mouth envelope where the clip was paused
+        smc.play_envelope(paused["audio"], 0.0, paused["position"])
+    return response
+
+# *** Playback Status ***
+@router.get('/audio/status')
+def playback_status():
+    """
+    Whether a clip is currently playing, and its position/duration in seconds.
+    """
+    return t2s.status()
+
 # *** Get system volume ***
 @router.get("/audio/volume")
 def get_volume():
@@ -121,6 +288,28 @@ def set_mouth(state: str):
     return smc.set_mouth(state)
 
 
+# ----- HEALTH ENDPOINT -----
+# *** Readiness Probe ***
+@app.get('/health')
+def health():
+    """
+    Answers once the app has started (catalog loaded, face link started), e.g. for deploy/launcher.py.
+    'Face' tells whether the face hub is reachable (embedded or over the WebSocket link).
+    """
+    return {"Status": "OK", "Face": bool(smc.face_link.connected), "Hub": smc.hub_mode}
+
+
+# ----- METRICS ENDPOINT -----
+# *** Prometheus Metrics ***
+@app.get('/metrics', response_class=PlainTextResponse)
+def get_metrics():
+    """
+    TTS synthesis latency, play-start latency, mood command round trips, face link state
+    and reconnections, in the Prometheus text format.
+    """
+    return metrics.registry.render()
+
+
 # ----- REGISTER ROUTER -----
 # Add the router's routes to the main application
 app.include_router(router)
@@ -130,6 +319,15 @@ app.include_router(router)
 # --- Server Execution Blocks ---
 # For local development with Uvicorn (FastAPI's standard server)
 if __name__ == '__main__':
-    # The 'reload=True' flag enables hot-reloading for development
-    uvicorn.run("app_fastapi:app", host='0.0.0.0', port=9021, reload=True)
+    parser = argparse.ArgumentParser(description="Robot face API server")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=9021)
+    parser.add_argument("--reload", action="store_true", help="development mode: restart on code changes")
+    args = parser.parse_args()
+    if args.reload:
+        # Hot-reloading spawns a watcher process and re-imports the app, for development only
+        uvicorn.run("app_fastapi:app", host=args.host, port=args.port, reload=True)
+    else:
+        # Production: the app object already imported, a single process, no file watcher
+        uvicorn.run(app, host=args.host, port=args.port)
 
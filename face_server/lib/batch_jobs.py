@@ -0,0 +1,116 @@
+"""
+@description: Bulk audio creation jobs. A batch of {Mood, Name, Text} items is synthesized in the
+background with a bounded number of concurrent TTS requests and retries with exponential backoff.
+Progress and per-item results are kept in memory and returned by the status endpoint.
+"""
+
+import os
+import time
+import uuid
+import asyncio
+from collections import OrderedDict
+import lib.soundmood_control as smc
+
+# Default number of simultaneous TTS requests (ROBOT_FACE_TTS_CONCURRENCY)
+default_concurrency = int(os.environ.get("ROBOT_FACE_TTS_CONCURRENCY", "4"))
+max_concurrency = 16
+max_retries = 3
+backoff_base = 0.5 # Seconds before the first retry, doubled on every attempt
+max_jobs = 50      # Finished jobs kept for the status endpoint
+
+REQUIRED_KEYS = ("Mood", "Name", "Text")
+
+jobs = OrderedDict() # job_id -> BatchJob
+
+
+# ----- BATCH JOB -----
+class BatchJob:
+    def __init__(self, items, concurrency):
+        self.id = uuid.uuid4().hex[:12]
+        self.items = items
+        self.concurrency = concurrency
+        self.created = time.time()
+        self.finished = None
+        self.results = [{"Name": item.get("Name"), "Mood": item.get("Mood"), "Status": "Pending", "Attempts": 0}
+                        for item in items]
+        self.task = None
+
+    def status(self):
+        counts = {}
+        for result in self.results:
+            counts[result["Status"]] = counts.get(result["Status"], 0) + 1
+        end = self.finished or time.time()
+        return {
+            "JobId": self.id,
+            "State": "Finished" if self.finished else "Running",
+            "Total": len(self.items),
+            "Done": len(self.items) - counts.get("Pending", 0),
+            "Counts": counts,
+            "Elapsed": round(end - self.created, 3),
+            "Results": self.results,
+        }
+
+    # *** Job Execution (event loop) ***
+    async def run(self):
+        semaphore = asyncio.Semaphore(self.concurrency)
+        await asyncio.gather(*(self._create(index, semaphore) for index in range(len(self.items))))
+        self.finished = time.time()
+        print(f"Batch job {self.id} finished: {self.status()['Counts']}")
+
+    async def _create(self, index, semaphore):
+        item, result = self.items[index], self.results[index]
+        missing = [key for key in REQUIRED_KEYS if not item.get(key)]
+        if missing:
+            result.update(Status="Failed", Error=f"Missing {', '.join(missing)}")
+            return
+
+        for attempt in range(max_retries + 1):
+            if attempt:
+                await asyncio.sleep(backoff_base * 2 ** (attempt - 1))
+            result["Attempts"] = attempt + 1
+            async with semaphore:
+                try:
+                    # The TTS request is blocking, it runs in a worker thread
+                    response = await asyncio.to_thread(smc.post_audio, item)
+                except Exception as e:
+                    response = {"Status": False, "Description": str(e)}
+            if response.get("Status"):
+                result.update(Status="Created")
+                result.pop("Error", None)
+                return
+            result["Error"] = response.get("Description")
+        result["Status"] = "Failed"
+
+
+# ----- JOB REGISTRY -----
+def start_job(data):
+    """
+    Starts a batch creation job. Must be called from the event loop.
+
+    data = {"Items": [{"Mood": "Feliz", "Name": "hola", "Text": "hola"}, ...], "Concurrency": 4}
+    """
+    items = data.get("Items")
+    if not isinstance(items, list) or not items:
+        return {"Status": False, "Description": "'Items' must be a non-empty list of {Mood, Name, Text}."}
+    items = [item if isinstance(item, dict) else {} for item in items]
+    try:
+        concurrency = min(max(int(data.get("Concurrency", default_concurrency)), 1), max_concurrency)
+    except (TypeError, ValueError):
+        return {"Status": False, "Description": "'Concurrency' must be an integer."}
+
+    job = BatchJob(items, concurrency)
+    jobs[job.id] = job
+    while len(jobs) > max_jobs: # Forget the oldest finished jobs
+        oldest = next(iter(jobs.values()))
+        if not oldest.finished:
+            break
+        jobs.popitem(last=False)
+
+    job.task = asyncio.get_running_loop().create_task(job.run())
+    return {"Status": True, "JobId": job.id, "Total": len(items), "Concurrency": concurrency}
+
+def get_job(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return {"Status": False, "Description": f"Job {job_id} not found"}
+    return job.status()
@@ -0,0 +1,186 @@
+"""
+@description: In-memory catalog of the audio library. It is loaded once at startup, updated by
+post_audio/delete_audio and by a polling filesystem watcher, and answers the audio listing
+(filter by mood, prefix search, pagination) without touching the disk. Every change bumps a
+version used as ETag, so polling clients get a cheap "304 Not Modified".
+Test audios ("@Test@") are not listed and are removed by a periodic cleanup task.
+"""
+
+import os
+import time
+import uuid
+import threading
+import numpy as np
+import lib.clip_meta as clip_meta
+import lib.pcm_store as pcm_store
+import lib.decoder as decoder
+import lib.t2s as t2s
+
+audios_dir = "lib/audios/"
+TEST_MARK = "@Test@"
+
+watch_interval = 2.0    # Seconds between two scans of the audios directory
+cleanup_interval = 60.0 # Seconds between two test-audio cleanups
+test_audio_max_age = 30.0 # Test audios younger than this are kept (the caller may still check them)
+full_scan_interval = 60.0 # Seconds between two scans even if the directory did not change (in-place overwrites)
+
+
+# ----- CATALOG -----
+class Catalog:
+    def __init__(self):
+        self.entries = {}  # Mood_Name -> entry dictionary
+        self.version = 0   # Incremented on every change (ETag)
+        self.boot = uuid.uuid4().hex[:8] # Per-process nonce, so a restarted server never reuses an old ETag
+        self._stamps = {}  # Mood_Name -> (mtime, size) of its mp3, meta and pcm files, seen by the watcher
+        self._lock = threading.Lock()
+        self._threads = []
+        self._dir_mtime = None # Directory mtime seen by the last watcher scan
+        self._scanned_at = 0.0
+
+    # *** Entries ***
+    def _stamp(self, audio_file):
+        stamp = []
+        for path_file in (audios_dir + audio_file + ".mp3", clip_meta.meta_path(audio_file), pcm_store.pcm_path(audio_file)):
+            try:
+                stat = os.stat(path_file)
+                stamp.append((stat.st_mtime, stat.st_size))
+            except FileNotFoundError:
+                stamp.append(None)
+        return tuple(stamp)
+
+    def _read_entry(self, audio_file):
+        try:
+            stat = os.stat(audios_dir + audio_file + ".mp3")
+        except FileNotFoundError:
+            return None
+        meta = clip_meta.load_meta(audio_file)
+        return {
+            "Name": audio_file,
+            "Mood": meta.get("Mood", audio_file.split("_")[0]),
+            "Duration": meta.get("Duration", self._duration(audio_file)),
+            "Size": stat.st_size,
+            "Text": meta.get("Text"),
+            "Created": meta.get("Created", stat.st_mtime),
+            "Loudness": meta.get("Loudness"), # LUFS, None until analysed (lib/loudness.py)
+            "Peak": meta.get("Peak"),         # dBFS
+            "Gain": meta.get("Gain"),         # dB applied at playback
+        }
+
+    @staticmethod
+    def _duration(audio_file):
+        """Duration in seconds, read from the PCM sidecar header (None until the sidecar exists)."""
+        try:
+            samples = np.load(pcm_store.pcm_path(audio_file), mmap_mode='r')
+        except (FileNotFoundError, ValueError, OSError):
+            return None
+        return round(len(samples) / decoder.DEVICE_SAMPLE_RATE, 3)
+
+    def refresh(self, audio_file):
+        """(Re)reads one clip, e.g. after post_audio. Removes it if its MP3 no longer exists."""
+        if TEST_MARK in audio_file:
+            return
+        entry = self._read_entry(audio_file)
+        with self._lock:
+            self._stamps[audio_file] = self._stamp(audio_file)
+            if entry is None:
+                self._stamps.pop(audio_file, None)
+                if self.entries.pop(audio_file, None) is None:
+                    return
+            else:
+                self.entries[audio_file] = entry
+            self.version += 1
+
+    def remove(self, audio_file):
+        with self._lock:
+            self._stamps.pop(audio_file, None)
+            if self.entries.pop(audio_file, None) is not None:
+                self.version += 1
+
+    def gain(self, audio_file):
+        """Linear loudness normalization gain of a clip (1.0 if not analysed), used by the player."""
+        entry = self.entries.get(audio_file)
+        if entry is None or not entry.get("Gain"):
+            return 1.0
+        return 10 ** (entry["Gain"] / 20)
+
+    # *** Listing ***
+    def query(self, mood=None, prefix=None, offset=0, limit=None):
+        """Returns (entries sorted by name, total count before pagination)."""
+        with self._lock:
+            entries = self.entries
+            names = sorted(entries)
+            if mood:
+                names = [name for name in names if entries[name]["Mood"] == mood]
+            if prefix:
+                names = [name for name in names if name.startswith(prefix)]
+            total = len(names)
+            end = None if limit is None else offset + limit
+            return [entries[name] for name in names[offset:end]], total
+
+    # *** Startup Load and Watcher ***
+    def _scan(self):
+        """Returns the clip names currently in the audios directory."""
+        try:
+            return {entry.name[:-4] for entry in os.scandir(audios_dir)
+                    if entry.name.endswith(".mp3") and TEST_MARK not in entry.name}
+        except FileNotFoundError:
+            return set()
+
+    def load(self):
+        for audio_file in self._scan():
+            self.refresh(audio_file)
+
+    def watch_once(self):
+        """
+        Applies the changes made to the directory outside of the API (copies, deletions, new sidecars).
+        Every library write is an atomic rename, which changes the directory mtime: while it does not
+        change, the clips are not stat'ed (only a periodic full scan, for files overwritten in place).
+        """
+        try:
+            dir_mtime = os.stat(audios_dir).st_mtime_ns # Read before the scan: a later change is seen next time
+        except FileNotFoundError:
+            dir_mtime = None
+        now = time.monotonic()
+        if dir_mtime == self._dir_mtime and now - self._scanned_at < full_scan_interval:
+            return
+        self._dir_mtime, self._scanned_at = dir_mtime, now
+        current = self._scan()
+        for audio_file in set(self._stamps) - current:
+            self.remove(audio_file)
+        for audio_file in current:
+            if self._stamps.get(audio_file) != self._stamp(audio_file):
+                self.refresh(audio_file)
+
+    def start(self):
+        """Loads the catalog and starts the watcher and the test-audio cleanup threads."""
+        self.load()
+        for target, interval in ((self.watch_once, watch_interval), (cleanup_test_audios, cleanup_interval)):
+            thread = threading.Thread(target=_every, args=(interval, target), daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+
+# ----- BACKGROUND TASKS -----
+def _every(interval, task):
+    while True:
+        time.sleep(interval)
+        try:
+            task()
+        except Exception as e:
+            print(f"Catalog task error: {e}")
+
+def cleanup_test_audios():
+    """Removes the test audios (name containing '@Test@') and their sidecars."""
+    now = time.time()
+    # ctime: when the clip was linked into the library (its mtime is the one of its TTS cache entry)
+    for entry in os.scandir(audios_dir):
+        if TEST_MARK in entry.name and entry.name.endswith(".mp3") and now - entry.stat().st_ctime > test_audio_max_age:
+            audio_file = entry.name[:-4]
+            t2s.eraseAudio(audio_file)
+            pcm_store.store.schedule_removal(audio_file)
+            print(f"{entry.name} removed since it is a test audio")
+
+
+# Shared catalog of the face_server process
+store = Catalog()
+t2s.player.clip_gain = store.gain # Clips play at their normalized loudness
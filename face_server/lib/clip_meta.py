@@ -0,0 +1,54 @@
+"""
+@description: Per-clip metadata sidecar ("Mood_Name.meta.json", next to the MP3): source text,
+creation time and any value computed later for the clip.
+"""
+
+import os
+import json
+import threading
+
+audios_dir = "lib/audios/"
+META_EXT = ".meta.json"
+
+_lock = threading.Lock() # Serializes read-modify-write updates within the process
+
+
+# ----- PATHS -----
+def meta_path(audio_file):
+    return audios_dir + audio_file + META_EXT
+
+
+# ----- READ / WRITE -----
+def load_meta(audio_file):
+    """Returns the metadata dictionary of a clip ({} if it has none)."""
+    try:
+        with open(meta_path(audio_file), encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+def _write_meta(audio_file, meta):
+    """Atomic write (temporary file per writer + rename)."""
+    tmp_path = f"{meta_path(audio_file)}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as out:
+        json.dump(meta, out, ensure_ascii=False)
+    os.replace(tmp_path, meta_path(audio_file))
+
+def save_meta(audio_file, meta):
+    """Replaces the metadata of a clip (e.g. when it is created again)."""
+    with _lock:
+        _write_meta(audio_file, meta)
+
+def update_meta(audio_file, **fields):
+    """Merges 'fields' into the metadata of a clip."""
+    with _lock:
+        meta = load_meta(audio_file)
+        meta.update(fields)
+        _write_meta(audio_file, meta)
+        return meta
+
+def erase_meta(audio_file):
+    try:
+        os.remove(meta_path(audio_file))
+    except FileNotFoundError:
+        pass
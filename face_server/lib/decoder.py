@@ -0,0 +1,36 @@
+"""
+@description: Decodes the library audio files (MP3) into mono PCM samples using the
+ffmpeg command line tool, so they can be analysed or played from Python.
+"""
+
+import subprocess
+import numpy as np
+
+# Sample rate used by the audio server loopback capture (face_moods/audioServer.py)
+DEVICE_SAMPLE_RATE = 44100
+
+
+# ----- DECODE AUDIO FILE -----
+def decode_file(path_file, samplerate=DEVICE_SAMPLE_RATE):
+    """
+    Decodes an audio file into a float32 mono numpy array in [-1, 1], resampled to 'samplerate'.
+    Returns None if the file could not be decoded.
+    """
+    return _decode(path_file, None, samplerate)
+
+# *** Decode In-Memory Audio (e.g. a TTS response) ***
+def decode_bytes(content, samplerate=DEVICE_SAMPLE_RATE):
+    """Same as decode_file for encoded audio held in memory (MP3, WAV...)."""
+    return _decode("pipe:0", content, samplerate)
+
+def _decode(source, content, samplerate):
+    cmd = ["ffmpeg", "-v", "error", "-nostdin", "-i", source,
+           "-f", "s16le", "-acodec", "pcm_s16le", "-ac", "1", "-ar", str(samplerate), "-"]
+    try:
+        result = subprocess.run(cmd, input=content, capture_output=True, check=True)
+    except (subprocess.CalledProcessError, FileNotFoundError) as e:
+        print(f"Could not decode {'audio data' if content is not None else source}: {e}")
+        return None
+
+    samples = np.frombuffer(result.stdout, dtype=np.int16)
+    return samples.astype(np.float32) / 32768.0
@@ -0,0 +1,97 @@
+"""
+@description: Single-process deployment (ROBOT_FACE_HUB=embedded). The face WebSocket hub of
+face_moods/audioServer.py (faces on ws://localhost:8760, loopback analysis) runs inside the
+FastAPI process, on its own thread and event loop, and the mood/mouth/envelope commands are
+applied to it in memory instead of going through a WebSocket client. Same interface as FaceLink.
+"""
+
+import os
+import sys
+import time
+import asyncio
+import threading
+from lib.face_link import mood_round_trip
+
+FACE_MOODS_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "face_moods"))
+
+
+# ----- EMBEDDED HUB -----
+class EmbeddedHub:
+    """Runs audioServer.mainAsync on a 'face-hub' thread; publish() hands it commands directly."""
+
+    def __init__(self, loopback_wav=None):
+        self.loopback_wav = loopback_wav # Fake loopback device (no sound card), as --loopback-wav
+        self.server = None # The audioServer module, imported on start
+        self.connected = False # True while the hub is serving (port bound)
+        self.reconnects = 0
+        self.pending = 0 # Commands handed to the hub loop and not applied yet
+        self._pending_lock = threading.Lock() # 'pending' is changed by the API threads and the hub loop
+        self._loop = None
+        self._thread = None
+        self._main = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    @property
+    def depth(self):
+        return self.pending
+
+    # *** Lifecycle (FastAPI lifespan) ***
+    def start(self):
+        if FACE_MOODS_DIR not in sys.path: # Appended, as in envelope.py
+            sys.path.append(FACE_MOODS_DIR)
+        import audioServer # Imported here, so the two-process layout never loads the hub
+        self.server = audioServer
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run, name="face-hub", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self._loop)
+        self._main = self._loop.create_task(self.server.mainAsync(self.loopback_wav, on_listening=self._listening))
+        try:
+            self._loop.run_until_complete(self._main)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            print(f"Embedded face hub stopped: {e}")
+        finally:
+            self.connected = False
+            self._loop.close()
+
+    def _listening(self):
+        # Only once the port is bound: if it is taken (e.g. a standalone audioServer.py runs),
+        # mainAsync fails and the hub is never reported connected nor sent commands
+        self.connected = True
+        print("Embedded face hub listening")
+
+    async def stop(self):
+        if self.running:
+            self._loop.call_soon_threadsafe(self._main.cancel)
+            await asyncio.get_running_loop().run_in_executor(None, self._thread.join, 5)
+
+    # *** Publish (any thread, never blocks) ***
+    def publish(self, command):
+        """Applies a command dictionary ({"type": "mood", ...}) on the hub loop."""
+        if not self.connected:
+            return
+        with self._pending_lock:
+            self.pending += 1
+        try:
+            asyncio.run_coroutine_threadsafe(self._apply(command, time.monotonic()), self._loop)
+        except RuntimeError: # The hub loop stopped meanwhile
+            with self._pending_lock:
+                self.pending -= 1
+
+    async def _apply(self, command, sent):
+        try:
+            await self.server.apply_command(command)
+        except Exception as e:
+            print(f"Embedded face hub could not apply {command.get('type')}: {e}")
+        finally:
+            with self._pending_lock:
+                self.pending -= 1
+        if command.get("type") == "mood": # Command to broadcast, no socket hop
+            mood_round_trip.observe(time.monotonic() - sent)
@@ -0,0 +1,90 @@
+"""
+@description: Precomputes the mouth-openness (bass) envelope of a library audio file, so the
+audio server can stream it while the clip plays instead of running a live loopback FFT.
+The envelope is stored next to the audio file as "Mood_Name.env.npy" (one uint8 per chunk).
+It is computed by the same DspPipeline as the live loopback analysis (face_moods/dsp.py), so
+library clips and live speech move the mouth the same way.
+"""
+
+import os
+import sys
+import threading
+import numpy as np
+import lib.decoder as decoder
+
+FACE_MOODS_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "face_moods"))
+if FACE_MOODS_DIR not in sys.path: # Appended: its top-level modules never shadow installed or app ones
+    sys.path.append(FACE_MOODS_DIR)
+from dsp import DspPipeline
+
+audios_dir = "lib/audios/"
+ENVELOPE_EXT = ".env.npy"
+
+# --- Analysis settings ---
+# IMPORTANT: THESE VALUES MIRROR THE ONES OF "face_moods/audioServer.py" (sampleRate, chunkSize, bass
+# band); the window, AGC and attack/release smoothing are the DspPipeline defaults, as in audioServer
+sampleRate = decoder.DEVICE_SAMPLE_RATE
+chunkSize = 1024
+bassRangeStart, bassRangeEnd = 160, 255
+
+# Time between two envelope values, in seconds
+HOP = chunkSize / sampleRate
+
+
+# ----- PATHS -----
+def envelope_path(audio_file):
+    return audios_dir + audio_file + ENVELOPE_EXT
+
+
+# ----- ENVELOPE COMPUTATION -----
+# *** Bass Envelope of a PCM signal ***
+def compute_envelope(samples):
+    """
+    Returns the bass level (uint8, 0-255) for each 'chunkSize' block of 'samples', from a fresh
+    DspPipeline (Hann window, AGC, attack/release smoothing), like the live loopback analysis
+    of the clip would produce.
+    """
+    n_chunks = len(samples) // chunkSize
+    if n_chunks == 0:
+        return np.zeros(0, dtype=np.uint8)
+
+    pipeline = DspPipeline(sampleRate, chunkSize, bands={"bass": (bassRangeStart, bassRangeEnd)})
+    chunks = np.asarray(samples[:n_chunks * chunkSize], dtype=np.float32).reshape(n_chunks, chunkSize)
+    levels = np.fromiter((pipeline.process(chunk)["bass"] for chunk in chunks), dtype=np.float64, count=n_chunks)
+    return np.round(levels * 255).astype(np.uint8)
+
+# *** Build and Store the Envelope of a Library File ***
+def build_envelope(audio_file):
+    """Decodes 'audio_file' (Mood_Name, without extension) and stores its envelope. Returns True on success."""
+    samples = decoder.decode_file(audios_dir + audio_file + ".mp3", sampleRate)
+    if samples is None:
+        return False
+
+    save_envelope(audio_file, compute_envelope(samples))
+    return True
+
+# *** Store an Envelope ***
+def save_envelope(audio_file, levels):
+    """
+    Atomic write (temporary file + rename), so a concurrent play never loads a partial envelope.
+    The temporary name is unique per process and thread (API, sidecar thread, reindex workers).
+    """
+    tmp_path = f"{envelope_path(audio_file)}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as out:
+        np.save(out, levels)
+    os.replace(tmp_path, envelope_path(audio_file))
+
+# *** Load a Stored Envelope ***
+def load_envelope(audio_file):
+    """Returns the stored envelope of 'audio_file' or None if the clip has no envelope."""
+    try:
+        return np.load(envelope_path(audio_file))
+    except (FileNotFoundError, ValueError, OSError):
+        return None
+
+# *** Remove a Stored Envelope ***
+def erase_envelope(audio_file):
+    try:
+        os.remove(envelope_path(audio_file))
+    except FileNotFoundError:
+        pass
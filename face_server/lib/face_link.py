@@ -0,0 +1,128 @@
+"""
+@description: Long-lived WebSocket client to the face audio server (face_moods/audioServer.py).
+It runs as a task of the FastAPI event loop, reconnects automatically and keeps a bounded
+outbound queue, so sending a mood/mouth command returns immediately without a handshake.
+"""
+
+import json
+import asyncio
+import threading
+from collections import deque
+import websockets
+import lib.metrics as metrics
+
+MOOD_PREFIX = '{"type": "mood"' # Mood commands, echoed by the server to every client
+max_echoes = 32 # Moods waiting for their echo
+
+mood_round_trip = metrics.registry.histogram("mood_round_trip_seconds", "Mood command sent until its broadcast is received back")
+reconnects = metrics.registry.counter("face_link_reconnects_total", "Reconnections to the face audio server")
+
+
+# ----- FACE LINK -----
+class FaceLink:
+    """Persistent, reconnecting connection used by soundmood_control to send commands."""
+
+    def __init__(self, uri, max_queue=64):
+        self.uri = uri
+        self.queue = deque(maxlen=max_queue) # Oldest commands are dropped if the server is down for long
+        self.connected = False
+        self.reconnects = 0
+        self._loop = None
+        self._loop_thread = None
+        self._wakeup = None
+        self._task = None
+        self._echoes = {} # Mood message -> loop time it was sent
+
+    @property
+    def running(self):
+        return self._task is not None and not self._task.done()
+
+    @property
+    def depth(self):
+        return len(self.queue)
+
+    # *** Lifecycle (FastAPI lifespan) ***
+    def start(self):
+        """Starts the connection task on the running event loop."""
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._wakeup = asyncio.Event()
+        self._task = self._loop.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    # *** Send (any thread, never blocks) ***
+    def send(self, message):
+        """Queues a JSON string for the audio server. Safe to call from the worker threads of sync endpoints."""
+        if threading.get_ident() == self._loop_thread:
+            self._enqueue(message)
+        else:
+            self._loop.call_soon_threadsafe(self._enqueue, message)
+
+    def publish(self, command):
+        """Queues a command dictionary ({"type": "mood", ...}), serialized to JSON."""
+        self.send(json.dumps(command))
+
+    def _enqueue(self, message):
+        # Repeated identical commands still waiting to be sent are collapsed into one
+        if self.queue and self.queue[-1] == message:
+            return
+        self.queue.append(message)
+        self._wakeup.set()
+
+    # *** Connection Task ***
+    async def _run(self):
+        # websockets.connect used as an async iterator reconnects with exponential backoff
+        async for websocket in websockets.connect(self.uri):
+            self.connected = True
+            print(f"Connected to the face server {self.uri}")
+            reader = asyncio.create_task(self._read(websocket))
+            try:
+                # Control role: the server sends it the mood echoes only (no audio frames) and does
+                # not count it as a face, so its analysis still pauses when no face is connected
+                await websocket.send(json.dumps({"type": "hello", "role": "control"}))
+                while not reader.done():
+                    while self.queue:
+                        message = self.queue[0]
+                        await websocket.send(message)
+                        self.queue.popleft() # Removed only once sent, so it is retried after a reconnection
+                        if message.startswith(MOOD_PREFIX):
+                            self._track_echo(message)
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+            except websockets.exceptions.ConnectionClosed:
+                pass
+            finally:
+                reader.cancel()
+            self.connected = False
+            self.reconnects += 1
+            reconnects.inc()
+            print(f"Connection to {self.uri} lost, reconnecting...")
+
+    async def _read(self, websocket):
+        """
+        Reads everything the server sends (so its queue for this client never fills up and
+        the link is not dropped as a slow client) and times the mood echoes (round trip).
+        """
+        try:
+            async for message in websocket:
+                if isinstance(message, str):
+                    sent = self._echoes.pop(message, None)
+                    if sent is not None:
+                        mood_round_trip.observe(self._loop.time() - sent)
+        except websockets.exceptions.ConnectionClosed:
+            pass
+        finally:
+            self._wakeup.set() # The send loop notices the closed connection
+
+    def _track_echo(self, message):
+        if len(self._echoes) >= max_echoes: # Never echoed (e.g. unknown mood), oldest forgotten
+            self._echoes.pop(next(iter(self._echoes)))
+        self._echoes[message] = self._loop.time()
@@ -0,0 +1,256 @@
+"""
+@description: Loudness normalization of the audio library. Every clip is analysed once (ITU-R
+BS.1770 integrated loudness, sample peak, duration) and gets a gain that brings it to a common
+loudness without clipping. The gain is stored in its metadata sidecar and applied by the player
+(the mouth envelope is left as it is: the DSP automatic gain control makes it level-independent).
+The reindex job analyses the new or changed clips in a process pool (all cores).
+
+@usage: cd face_server && python3 -m lib.loudness [--force] [--workers N]
+"""
+
+import os
+import time
+import argparse
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import lib.decoder as decoder
+import lib.clip_meta as clip_meta
+import lib.pcm_store as pcm_store
+
+audios_dir = "lib/audios/"
+TEST_MARK = "@Test@" # Test audios are not analysed (same mark as the catalog)
+
+# --- Normalization ---
+target_loudness = float(os.environ.get("ROBOT_FACE_LOUDNESS_TARGET", "-18")) # LUFS
+peak_ceiling = -1.0 # dBFS, the gain never pushes the peak above it
+max_gain = 12.0     # dB, in both directions
+
+# --- Reindex ---
+request_delay = 2.0 # Seconds without new clips before a requested reindex starts (a batch runs once)
+
+# --- BS.1770 gating ---
+BLOCK = 0.4           # Seconds per gating block
+BLOCK_HOP = 0.1       # 75 % overlap
+ABSOLUTE_GATE = -70.0 # LUFS
+RELATIVE_GATE = -10.0 # LU below the absolutely gated loudness
+
+
+# ----- ANALYSIS -----
+def _biquad(b, a, z_inv):
+    return (b[0] + b[1] * z_inv + b[2] * z_inv ** 2) / (a[0] + a[1] * z_inv + a[2] * z_inv ** 2)
+
+def k_weighting(n_fft, samplerate):
+    """Frequency response (rfft bins) of the BS.1770 K-weighting: high shelf (+4 dB) then high pass."""
+    z_inv = np.exp(-2j * np.pi * np.arange(n_fft // 2 + 1) / n_fft)
+    # High shelf, 1500 Hz, +4 dB
+    gain, w0, q = 10 ** (4.0 / 40), 2 * np.pi * 1500.0 / samplerate, 1 / np.sqrt(2)
+    alpha, cos_w0, sqrt_gain = np.sin(w0) / (2 * q), np.cos(w0), np.sqrt(gain)
+    shelf = _biquad(
+        (gain * ((gain + 1) + (gain - 1) * cos_w0 + 2 * sqrt_gain * alpha),
+         -2 * gain * ((gain - 1) + (gain + 1) * cos_w0),
+         gain * ((gain + 1) + (gain - 1) * cos_w0 - 2 * sqrt_gain * alpha)),
+        ((gain + 1) - (gain - 1) * cos_w0 + 2 * sqrt_gain * alpha,
+         2 * ((gain - 1) - (gain + 1) * cos_w0),
+         (gain + 1) - (gain - 1) * cos_w0 - 2 * sqrt_gain * alpha),
+        z_inv)
+    # High pass, 38 Hz
+    w0, q = 2 * np.pi * 38.0 / samplerate, 0.5
+    alpha, cos_w0 = np.sin(w0) / (2 * q), np.cos(w0)
+    high_pass = _biquad(((1 + cos_w0) / 2, -(1 + cos_w0), (1 + cos_w0) / 2), (1 + alpha, -2 * cos_w0, 1 - alpha), z_inv)
+    return shelf * high_pass
+
+def integrated_loudness(samples, samplerate):
+    """Gated integrated loudness (LUFS) of a mono signal, None if it is silent."""
+    # K-weighting applied as one FFT filter (zero padding absorbs the filter tail)
+    n_fft = 1 << int(np.ceil(np.log2(len(samples) + samplerate // 2)))
+    weighted = np.fft.irfft(np.fft.rfft(samples, n_fft) * k_weighting(n_fft, samplerate), n_fft)[:len(samples)]
+
+    # Mean square of every 400 ms block (75 % overlap), from a cumulative sum of squares
+    block, hop = int(BLOCK * samplerate), int(BLOCK_HOP * samplerate)
+    energy = np.concatenate(([0.0], np.cumsum(weighted * weighted)))
+    if len(samples) < block:
+        powers = np.array([energy[-1] / max(len(samples), 1)])
+    else:
+        starts = np.arange(0, len(samples) - block + 1, hop)
+        powers = (energy[starts + block] - energy[starts]) / block
+
+    with np.errstate(divide="ignore"):
+        loudness = -0.691 + 10 * np.log10(powers)
+    gated = powers[loudness > ABSOLUTE_GATE]
+    if gated.size == 0:
+        return None
+    relative = -0.691 + 10 * np.log10(gated.mean()) + RELATIVE_GATE
+    gated = powers[(loudness > ABSOLUTE_GATE) & (loudness > relative)]
+    return float(-0.691 + 10 * np.log10(gated.mean()))
+
+def normalization_gain(loudness, peak):
+    """Gain (dB) to 'target_loudness', limited by the peak ceiling and 'max_gain'."""
+    if loudness is None:
+        return 0.0
+    gain = min(max(target_loudness - loudness, -max_gain), max_gain)
+    if peak is not None:
+        gain = min(gain, peak_ceiling - peak)
+    return round(gain, 2)
+
+def _load_samples(audio_file):
+    """float32 samples of a clip, from its PCM sidecar when it is up to date, else decoded."""
+    if not pcm_store._is_stale(audio_file):
+        try:
+            return np.load(pcm_store.pcm_path(audio_file)).astype(np.float32) * (1.0 / 32768)
+        except (ValueError, OSError):
+            pass
+    return decoder.decode_file(audios_dir + audio_file + ".mp3", decoder.DEVICE_SAMPLE_RATE)
+
+def analyze_clip(audio_file):
+    """
+    Pool worker: measures a clip. Returns the metadata fields, or None if it cannot be decoded.
+    """
+    samples = _load_samples(audio_file)
+    if samples is None or len(samples) == 0:
+        return None
+    samplerate = decoder.DEVICE_SAMPLE_RATE
+    loudness = integrated_loudness(samples.astype(np.float64), samplerate)
+    peak_level = float(np.max(np.abs(samples)))
+    peak = 20 * np.log10(peak_level) if peak_level > 0 else None
+    gain = normalization_gain(loudness, peak)
+    return {
+        "Loudness": round(loudness, 2) if loudness is not None else None,
+        "Peak": round(peak, 2) if peak is not None else None,
+        "Gain": gain,
+        "Duration": round(len(samples) / samplerate, 3),
+    }
+
+
+# ----- REINDEX JOB -----
+def _source_stamp(audio_file):
+    stat = os.stat(audios_dir + audio_file + ".mp3")
+    return [stat.st_mtime, stat.st_size]
+
+def needs_analysis(audio_file):
+    """True if the clip was never analysed, changed since, or was normalized to another target."""
+    meta = clip_meta.load_meta(audio_file)
+    try:
+        return meta.get("LoudnessOf") != _source_stamp(audio_file) or meta.get("LoudnessTarget") != target_loudness
+    except FileNotFoundError:
+        return False
+
+class ReindexJob:
+    """Library-wide analysis, one at a time, run from a background thread."""
+
+    def __init__(self):
+        self.state = "Idle"
+        self.total = self.analyzed = self.skipped = self.failed = 0
+        self.workers = 0
+        self.started = None
+        self.elapsed = 0.0
+        self._lock = threading.Lock()
+        self._timer = None  # Pending request() timer
+        self._rerun = False # Requested while running: run again once finished
+
+    def start(self, force=False, workers=None):
+        """Starts a reindex in the background (returns at once)."""
+        with self._lock:
+            if self.state == "Running":
+                return dict(self.status(), Status=False, Description="A reindex is already running")
+            self.state = "Running"
+            self.started = time.monotonic()
+            self.total = self.analyzed = self.skipped = self.failed = 0
+        threading.Thread(target=self.run, args=(force, workers), name="loudness-reindex", daemon=True).start()
+        return dict(self.status(), Status=True)
+
+    def request(self):
+        """Queues an incremental reindex, e.g. after post_audio. Requests closer than 'request_delay' are merged."""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+            self._timer = threading.Timer(request_delay, self._requested)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _requested(self):
+        with self._lock:
+            self._timer = None
+            if self.state == "Running":
+                self._rerun = True
+                return
+        self.start()
+
+    def run(self, force=False, workers=None):
+        import lib.catalog as catalog # Imported here, so the pool workers only load the analysis
+        self.state = "Running"
+        self.started = time.monotonic()
+        try:
+            names = sorted(entry.name[:-4] for entry in os.scandir(audios_dir)
+                           if entry.name.endswith(".mp3") and TEST_MARK not in entry.name)
+        except FileNotFoundError:
+            names = []
+        todo = [name for name in names if force or needs_analysis(name)]
+        # Source stamps taken before the analysis: a clip replaced meanwhile stays stale for the next run
+        stamps = {}
+        for name in todo:
+            try:
+                stamps[name] = _source_stamp(name)
+            except FileNotFoundError:
+                pass
+        todo = [name for name in todo if name in stamps]
+        self.total, self.skipped, self.analyzed, self.failed = len(names), len(names) - len(todo), 0, 0
+        self.workers = max(1, min(workers or os.cpu_count() or 1, len(todo)))
+        try:
+            if todo:
+                # Workers are forked from a fork server, not from this threaded process (no copy of
+                # the API threads and locks); it imports the main module once for all the workers
+                context = multiprocessing.get_context("forkserver")
+                context.set_forkserver_preload(["__main__"])
+                with ProcessPoolExecutor(self.workers, mp_context=context) as pool:
+                    chunksize = max(1, len(todo) // (self.workers * 4))
+                    for audio_file, fields in zip(todo, pool.map(analyze_clip, todo, chunksize=chunksize)):
+                        if fields is None:
+                            self.failed += 1
+                            continue
+                        if not os.path.exists(audios_dir + audio_file + ".mp3"): # Deleted meanwhile
+                            continue
+                        clip_meta.update_meta(audio_file, LoudnessOf=stamps[audio_file],
+                                              LoudnessTarget=target_loudness, **fields)
+                        catalog.store.refresh(audio_file)
+                        self.analyzed += 1
+        except Exception as e:
+            print(f"Loudness reindex error: {e}")
+        finally:
+            self.elapsed = time.monotonic() - self.started
+            with self._lock:
+                self.state = "Finished"
+                rerun, self._rerun = self._rerun, False
+        print(f"Loudness reindex: {self.analyzed} analysed, {self.skipped} up to date, {self.failed} failed in {self.elapsed:.2f} s")
+        if rerun:
+            self.request()
+
+    def status(self):
+        return {
+            "State": self.state,
+            "Total": self.total,
+            "Analyzed": self.analyzed,
+            "UpToDate": self.skipped,
+            "Failed": self.failed,
+            "Workers": self.workers,
+            "Elapsed": round(time.monotonic() - self.started if self.state == "Running" else self.elapsed, 3),
+            "Target": target_loudness,
+        }
+
+
+# Reindex job of the face_server process
+job = ReindexJob()
+
+
+# ----- COMMAND LINE -----
+def main():
+    parser = argparse.ArgumentParser(description="Analyse the loudness of the audio library and store the per-clip gain")
+    parser.add_argument("--force", action="store_true", help="analyse every clip, even the up to date ones")
+    parser.add_argument("--workers", type=int, help="worker processes (default: one per core)")
+    args = parser.parse_args()
+    job.run(args.force, args.workers)
+
+if __name__ == "__main__":
+    import lib.loudness as loudness # The pool pickles the worker as lib.loudness.analyze_clip, not __main__'s
+    loudness.main()
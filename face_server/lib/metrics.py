@@ -0,0 +1,19 @@
+"""
+@description: Metrics of face_server rendered in the Prometheus text format by GET /metrics.
+The registry is the one of the audio server (face_moods/metrics.py, imported like the DSP in
+envelope.py), with histogram buckets sized for API latencies.
+"""
+
+import os
+import sys
+
+FACE_MOODS_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "face_moods"))
+if FACE_MOODS_DIR not in sys.path: # Appended, as in envelope.py
+    sys.path.append(FACE_MOODS_DIR)
+from metrics import Registry
+
+# Upper bounds (s) of the default histogram buckets, from 1 ms to 30 s
+TIME_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Metrics of the face_server process (the modules add theirs at import time)
+registry = Registry("robot_face_", TIME_BUCKETS)
@@ -0,0 +1,210 @@
+"""
+@description: Decoded-PCM sidecar store for the audio library. Each clip "Mood_Name.mp3" gets a
+"Mood_Name.pcm.npy" sidecar (int16, mono, device sample rate) that is memory-mapped at play time,
+so no MP3 is decoded when playing. The most played clips are kept in RAM within a byte budget.
+A background thread converts the existing MP3s and keeps the sidecars in sync with the library.
+"""
+
+import os
+import queue
+import threading
+import numpy as np
+import lib.decoder as decoder
+import lib.envelope as envelope
+import lib.metrics as metrics
+
+audios_dir = "lib/audios/"
+PCM_EXT = ".pcm.npy"
+
+# In-RAM budget for the most played clips (ROBOT_FACE_PCM_CACHE_MB, default 32 MB)
+ram_budget = int(float(os.environ.get("ROBOT_FACE_PCM_CACHE_MB", "32")) * 1024 * 1024)
+
+
+# ----- PATHS -----
+def pcm_path(audio_file):
+    return audios_dir + audio_file + PCM_EXT
+
+def _is_stale(audio_file):
+    """
+    True if the sidecar is missing or was not decoded from the current MP3: a sidecar carries the
+    mtime its MP3 had when the decoding started (see PcmStore.build), any other value is stale.
+    """
+    try:
+        return os.stat(pcm_path(audio_file)).st_mtime_ns != os.stat(audios_dir + audio_file + ".mp3").st_mtime_ns
+    except FileNotFoundError:
+        return True
+
+
+# ----- PCM STORE -----
+class PcmStore:
+    """Sidecar access (mmap or RAM) and background sidecar synchronization."""
+
+    def __init__(self, budget=ram_budget, samplerate=decoder.DEVICE_SAMPLE_RATE):
+        self.budget = budget
+        self.samplerate = samplerate
+        self.play_counts = {}
+        self._ram = {} # audio_file -> int16 array fully loaded in memory
+        self._ram_bytes = 0
+        self._promoting = set() # Clips queued to be read into RAM
+        self._lock = threading.Lock()
+        self._jobs = queue.Queue()
+        self._worker = None
+
+    # *** Playback Access ***
+    def get(self, audio_file, count=True):
+        """
+        Returns the int16 samples of a clip (from RAM or memory-mapped), or None if it has no
+        up-to-date sidecar yet (e.g. the MP3 was just replaced): the caller decodes the MP3.
+        'count' is False for loads that are not plays (e.g. timeline preloads).
+        """
+        if _is_stale(audio_file): # One stat: never serve the previous audio of a replaced clip
+            self.schedule(audio_file)
+            return None
+        with self._lock:
+            if count:
+                self.play_counts[audio_file] = self.play_counts.get(audio_file, 0) + 1
+            if audio_file in self._ram:
+                return self._ram[audio_file]
+        try:
+            samples = np.load(pcm_path(audio_file), mmap_mode='r')
+        except (FileNotFoundError, ValueError, OSError):
+            self.schedule(audio_file)
+            return None
+        with self._lock:
+            if count and audio_file not in self._promoting and self._admit(audio_file, samples.nbytes) is not None:
+                # Read into RAM by the worker: the play itself only touches the pages it needs
+                self._promoting.add(audio_file)
+                self._jobs.put(("promote", audio_file))
+        return samples
+
+    def _admit(self, audio_file, nbytes):
+        """
+        Clips to evict so that 'audio_file' fits in RAM, or None if it should not be cached
+        (it is not played more than the clips it would evict). Called with the lock held.
+        """
+        if nbytes > self.budget:
+            return None
+        count = self.play_counts.get(audio_file, 0)
+        evicted = []
+        free = self.budget - self._ram_bytes
+        for name in sorted(self._ram, key=lambda name: self.play_counts.get(name, 0)):
+            if free >= nbytes:
+                break
+            if self.play_counts.get(name, 0) >= count:
+                return None # Every cached clip is played at least as often
+            evicted.append(name)
+            free += self._ram[name].nbytes
+        return evicted if free >= nbytes else None
+
+    def _promote(self, audio_file):
+        """Worker: reads a frequently played sidecar into RAM."""
+        try:
+            if _is_stale(audio_file):
+                return
+            samples = np.load(pcm_path(audio_file))
+            with self._lock:
+                if audio_file in self._ram:
+                    return
+                evicted = self._admit(audio_file, samples.nbytes)
+                if evicted is None:
+                    return
+                for name in evicted:
+                    self._evict(name)
+                self._ram[audio_file] = samples
+                self._ram_bytes += samples.nbytes
+        finally:
+            with self._lock:
+                self._promoting.discard(audio_file)
+
+    def _evict(self, audio_file):
+        samples = self._ram.pop(audio_file, None)
+        if samples is not None:
+            self._ram_bytes -= samples.nbytes
+
+    def ram_usage(self):
+        return {"clips": len(self._ram), "bytes": self._ram_bytes, "budget": self.budget}
+
+    # *** Background Synchronization ***
+    def start(self):
+        """Starts the sync thread and queues every MP3 of the library whose sidecar is missing or stale."""
+        if self._worker is None:
+            self._worker = threading.Thread(target=self._run, name="pcm-sidecars", daemon=True)
+            self._worker.start()
+        for filename in sorted(os.listdir(audios_dir)):
+            if not filename.endswith(".mp3"):
+                continue
+            if _is_stale(filename[:-4]):
+                self.schedule(filename[:-4])
+            elif not os.path.exists(envelope.envelope_path(filename[:-4])): # e.g. deleted to be rebuilt
+                self._jobs.put(("envelope", filename[:-4]))
+
+    def schedule(self, audio_file):
+        """Queues the (re)build of a clip sidecar, e.g. after post_audio."""
+        with self._lock:
+            self._evict(audio_file) # The RAM copy holds the previous audio
+        self._jobs.put(("build", audio_file))
+
+    def schedule_removal(self, audio_file):
+        """Queues the removal of a clip sidecar, e.g. after delete_audio."""
+        with self._lock:
+            self._evict(audio_file)
+            self.play_counts.pop(audio_file, None)
+        self._jobs.put(("remove", audio_file))
+
+    def _run(self):
+        while True:
+            action, audio_file = self._jobs.get()
+            try:
+                if action == "build":
+                    if _is_stale(audio_file):
+                        self.build(audio_file)
+                elif action == "promote":
+                    self._promote(audio_file)
+                elif action == "envelope":
+                    self.build_envelope(audio_file)
+                else:
+                    os.remove(pcm_path(audio_file))
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                print(f"PCM sidecar error for {audio_file}: {e}")
+
+    def build(self, audio_file):
+        """Decodes the MP3 once into its PCM sidecar (and its envelope if it has none). Returns True on success."""
+        # Stat taken before decoding: if the MP3 is replaced meanwhile, the sidecar keeps the
+        # previous stamp and stays stale, instead of looking newer than the new MP3
+        source = os.stat(audios_dir + audio_file + ".mp3")
+        samples = decoder.decode_file(audios_dir + audio_file + ".mp3", self.samplerate)
+        if samples is None:
+            return False
+
+        pcm = np.clip(np.round(samples * 32767), -32768, 32767).astype(np.int16)
+        # Atomic write: a concurrent play maps either the previous or the new sidecar
+        tmp_path = pcm_path(audio_file) + ".tmp"
+        with open(tmp_path, "wb") as out:
+            np.save(out, pcm)
+        os.utime(tmp_path, ns=(source.st_atime_ns, source.st_mtime_ns)) # Stamp of the decoded MP3
+        os.replace(tmp_path, pcm_path(audio_file))
+        if _is_stale(audio_file): # Replaced while decoding
+            self.schedule(audio_file)
+        with self._lock:
+            self._evict(audio_file)
+
+        if envelope.load_envelope(audio_file) is None:
+            envelope.save_envelope(audio_file, envelope.compute_envelope(samples))
+        print(f"PCM sidecar created for {audio_file}")
+        return True
+
+    def build_envelope(self, audio_file):
+        """Computes the missing envelope of a clip from its up-to-date sidecar (no MP3 decoding)."""
+        if _is_stale(audio_file):
+            self.schedule(audio_file) # The build creates the envelope too
+            return
+        samples = np.load(pcm_path(audio_file)).astype(np.float32) * (1.0 / 32768)
+        envelope.save_envelope(audio_file, envelope.compute_envelope(samples))
+        print(f"Envelope created for {audio_file}")
+
+
+# Shared store of the face_server process
+store = PcmStore()
+metrics.registry.gauge("pcm_cache_bytes", "Decoded clips kept in RAM by the PCM store", lambda: store.ram_usage()["bytes"])
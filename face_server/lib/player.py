@@ -0,0 +1,223 @@
+"""
+@description: In-process playback engine. Decoded PCM clips are written block by block to the
+default speaker (soundcard library) from a dedicated thread that keeps the output stream open,
+so a play starts almost instantly and stop/pause take effect within one block.
+"""
+
+import time
+import threading
+from collections import deque
+import numpy as np
+import lib.decoder as decoder
+
+
+# ----- CLIP -----
+class Clip:
+    """A decoded clip and its playback position (in samples)."""
+
+    def __init__(self, name, samples, on_start=None, priority=0, item_id=None, gain=1.0):
+        self.name = name
+        self.samples = samples # float32 [-1, 1] or int16 (e.g. memory-mapped sidecar)
+        self.gain = gain # Loudness normalization gain of the clip (linear)
+        self.position = 0
+        self.on_start = on_start # Called with the output latency (s) when the first block is written
+        self.priority = priority
+        self.item_id = item_id # Identifier given by the scheduler (cancel by id)
+
+
+# ----- NULL SPEAKER (benchmarks / tests without sound card) -----
+class NullSpeaker:
+    """Output stand-in that discards the samples, paced in real time like a sound card."""
+
+    def __init__(self, samplerate, blocksize):
+        self.samplerate = samplerate
+        self.latency = blocksize / samplerate
+        self._clock = None # Time when the queued samples finish playing
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def play(self, data):
+        now = time.monotonic()
+        if self._clock is None or self._clock < now: # Idle: the output buffer is empty
+            self._clock = now
+        self._clock += len(data) / self.samplerate
+        # Like a sound card with a one block buffer, returns when the block is queued
+        delay = self._clock - self.latency - now
+        if delay > 0:
+            time.sleep(delay)
+
+
+# ----- PLAYER -----
+class Player:
+    """
+    Single-voice player: a new play replaces the current clip (and the queued ones),
+    enqueued clips follow the current one without any gap.
+    """
+
+    def __init__(self, samplerate=decoder.DEVICE_SAMPLE_RATE, blocksize=512, output="soundcard"):
+        self.samplerate = samplerate
+        self.output = output # "soundcard" (default speaker) or "null" (no sound card)
+        self.blocksize = blocksize # Stop/pause granularity, in samples
+        self._cond = threading.Condition()
+        self._clip = None
+        self._queue = deque() # Clips played after the current one
+        self._paused = False
+        self._thread = None
+        self._gain = 1.0 # Software gain applied to the output (see set_gain)
+        self._gain_target = 1.0
+        self._gain_step = 0.0 # Gain change per sample while ramping
+        self.clip_gain = None # Callable name -> linear gain of the clip (loudness normalization), None = 1.0
+
+    # *** Controls (any thread) ***
+    def play(self, name, samples, on_start=None):
+        with self._cond:
+            self._queue.clear()
+            self._clip = self._new_clip(name, samples, on_start)
+            self._paused = False
+            self._cond.notify()
+            self._ensure_thread()
+
+    def enqueue(self, name, samples, on_start=None):
+        """Plays the clip right after the current and queued ones (immediately if idle)."""
+        with self._cond:
+            clip = self._new_clip(name, samples, on_start)
+            if self._clip is None:
+                self._clip = clip
+                self._cond.notify()
+            else:
+                self._queue.append(clip)
+            self._ensure_thread()
+
+    def submit(self, name, samples, on_start=None, priority=0, item_id=None):
+        """
+        Schedules a clip by priority: it preempts the current clip if its priority is higher,
+        otherwise it is queued after the clips of the same or higher priority.
+        Returns its position (0 = playing now).
+        """
+        with self._cond:
+            clip = self._new_clip(name, samples, on_start, priority, item_id)
+            self._ensure_thread()
+            if self._clip is None or priority > self._clip.priority:
+                self._clip = clip # The preempted clip is dropped, the queue is kept
+                self._paused = False
+                self._cond.notify()
+                return 0
+            index = next((i for i, queued in enumerate(self._queue) if queued.priority < priority), len(self._queue))
+            self._queue.insert(index, clip)
+            return index + 1
+
+    def cancel(self, item_id):
+        """Removes a queued clip, or skips to the next one if it is playing. False if not found."""
+        with self._cond:
+            if self._clip is not None and self._clip.item_id == item_id:
+                self._clip = self._queue.popleft() if self._queue else None
+                return True
+            for clip in self._queue:
+                if clip.item_id == item_id:
+                    self._queue.remove(clip)
+                    return True
+            return False
+
+    def _new_clip(self, name, samples, on_start=None, priority=0, item_id=None):
+        gain = self.clip_gain(name) if self.clip_gain is not None else 1.0
+        return Clip(name, samples, on_start, priority, item_id, gain)
+
+    def _ensure_thread(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="audio-player", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._queue.clear()
+            self._clip = None
+
+    def pause(self):
+        with self._cond:
+            self._paused = True
+
+    def resume(self):
+        with self._cond:
+            self._paused = False
+            self._cond.notify()
+
+    def set_gain(self, gain, ramp=0.05):
+        """Moves the software gain to 'gain' linearly over 'ramp' seconds (no clicks)."""
+        with self._cond:
+            self._gain_target = gain
+            self._gain_step = (gain - self._gain) / max(1, int(ramp * self.samplerate))
+
+    @property
+    def is_playing(self):
+        return self._clip is not None and not self._paused
+
+    def status(self):
+        clip = self._clip
+        if clip is None:
+            return {"playing": False, "paused": False, "audio": None}
+        return {
+            "playing": not self._paused,
+            "paused": self._paused,
+            "audio": clip.name,
+            "position": round(clip.position / self.samplerate, 3),
+            "duration": round(len(clip.samples) / self.samplerate, 3),
+            "queued": [queued.name for queued in self._queue],
+        }
+
+    def scheduled(self):
+        """Current clip (or None) and the queued clips, in playing order."""
+        with self._cond:
+            return self._clip, list(self._queue)
+
+    # *** Output Loop (player thread) ***
+    def _next_block(self):
+        """Waits for a clip to play and returns its next block, the clip and whether it just started."""
+        with self._cond:
+            while self._clip is None or self._paused:
+                self._cond.wait()
+            clip = self._clip
+            start = clip.position
+            block = clip.samples[start:start + self.blocksize]
+            clip.position += len(block)
+            if clip.position >= len(clip.samples): # Clip finished, the next one starts on the next block
+                self._clip = self._queue.popleft() if self._queue else None
+            target, step = self._gain_target, self._gain_step
+        if block.dtype == np.int16: # PCM sidecars are stored as int16
+            block = block.astype(np.float32) * np.float32(clip.gain / 32768)
+        elif clip.gain != 1.0:
+            block = block * np.float32(clip.gain)
+        return self._apply_gain(block, target, step), clip, start == 0
+
+    def _apply_gain(self, block, target, step):
+        if self._gain == target:
+            return block if target == 1.0 else block * np.float32(target)
+        ramp = self._gain + step * np.arange(1, len(block) + 1, dtype=np.float32)
+        ramp = np.minimum(ramp, target) if step > 0 else np.maximum(ramp, target)
+        self._gain = target if ramp[-1] == np.float32(target) else float(ramp[-1])
+        return block * ramp
+
+    def _open_output(self):
+        if self.output == "null":
+            return NullSpeaker(self.samplerate, self.blocksize)
+        import soundcard as sc # Imported here, so the null output works without a sound card
+        return sc.default_speaker().player(samplerate=self.samplerate, blocksize=self.blocksize)
+
+    def _run(self):
+        try:
+            with self._open_output() as speaker:
+                while True:
+                    block, clip, started = self._next_block()
+                    # Returns once the block is queued in the (blocksize long) output buffer
+                    speaker.play(block)
+                    if started and clip.on_start is not None:
+                        clip.on_start(speaker.latency)
+        except Exception as e:
+            print(f"Audio playback error: {e}")
+            with self._cond:
+                self._queue.clear()
+                self._clip = None
+                self._thread = None # The output is reopened on the next play
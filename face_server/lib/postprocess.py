@@ -0,0 +1,89 @@
+"""
+@description: Post-synthesis stage applied once to every TTS response before it is cached.
+The speech is decoded at the playback device rate (the only resampling the clip ever gets),
+the leading and trailing silence below a threshold is trimmed (keeping short pads so the
+first and last phonemes are not cut) and the result is encoded as the MP3 the library stores.
+Every play then starts on the voice instead of on the encoder's dead air.
+"""
+
+import os
+import tempfile
+import subprocess
+import numpy as np
+import lib.decoder as decoder
+
+# --- Trim Settings ---
+trim_threshold = float(os.environ.get("ROBOT_FACE_TRIM_THRESHOLD", "-45")) # dBFS, quieter windows are silence
+trim_window = 0.01 # Seconds per level measurement
+lead_pad = 0.02    # Seconds of silence kept before the voice
+tail_pad = 0.08    # Seconds kept after it (release of the last phoneme)
+
+# --- Output ---
+samplerate = decoder.DEVICE_SAMPLE_RATE
+mp3_bitrate = "96k"
+
+
+# ----- SETTINGS -----
+def settings():
+    """Values that change the processed clip (part of the TTS cache key)."""
+    return [trim_threshold, lead_pad, tail_pad, samplerate, mp3_bitrate]
+
+
+# ----- TRIM -----
+def silence_bounds(samples):
+    """Returns (start, end) sample indexes of the non-silent part, pads included. (0, 0) if all silent."""
+    window = max(1, int(trim_window * samplerate))
+    n_windows = -(-len(samples) // window)
+    padded = np.zeros(n_windows * window, dtype=np.float32)
+    padded[:len(samples)] = np.abs(samples)
+    loud = np.flatnonzero(padded.reshape(n_windows, window).max(axis=1) > 10 ** (trim_threshold / 20))
+    if loud.size == 0:
+        return 0, 0
+    start = max(0, loud[0] * window - int(lead_pad * samplerate))
+    end = min(len(samples), (loud[-1] + 1) * window + int(tail_pad * samplerate))
+    return start, end
+
+
+# ----- ENCODE -----
+def encode_mp3(samples):
+    """float32 mono samples at 'samplerate' -> MP3 bytes, None if ffmpeg fails."""
+    pcm = (np.clip(samples, -1.0, 1.0) * 32767).astype(np.int16).tobytes()
+    # Written to a seekable file, so ffmpeg adds the LAME header with the encoder delay and
+    # padding: decoders drop them and the clip does not start with ~25 ms of encoder silence
+    fd, tmp_path = tempfile.mkstemp(suffix=".mp3")
+    os.close(fd)
+    cmd = ["ffmpeg", "-v", "error", "-nostdin", "-y", "-f", "s16le", "-ar", str(samplerate), "-ac", "1", "-i", "pipe:0",
+           "-codec:a", "libmp3lame", "-b:a", mp3_bitrate, tmp_path]
+    try:
+        subprocess.run(cmd, input=pcm, capture_output=True, check=True)
+        with open(tmp_path, "rb") as f:
+            return f.read()
+    except (subprocess.CalledProcessError, FileNotFoundError) as e:
+        print(f"Could not encode the processed speech: {e}")
+        return None
+    finally:
+        os.remove(tmp_path)
+
+
+# ----- POST-SYNTHESIS STAGE -----
+def process(audio_content):
+    """
+    Returns (MP3 bytes, info) of a TTS response: resampled once to 'samplerate' and trimmed.
+    info = {"TrimStart": s, "TrimEnd": s, "Duration": s} (seconds removed at each end, final length).
+    Returns (None, None) if the audio cannot be processed (e.g. ffmpeg missing): the TTS response
+    is lossless PCM, not the MP3 the library stores, so it is never kept as it is.
+    """
+    samples = decoder.decode_bytes(audio_content, samplerate)
+    if samples is None or len(samples) == 0:
+        return None, None
+    start, end = silence_bounds(samples)
+    if end <= start: # Nothing above the threshold: keep the clip as it is
+        start, end = 0, len(samples)
+    content = encode_mp3(samples[start:end])
+    if content is None:
+        return None, None
+    return content, {
+        "TrimStart": round(start / samplerate, 3),
+        "TrimEnd": round((len(samples) - end) / samplerate, 3),
+        "Duration": round((end - start) / samplerate, 3),
+    }
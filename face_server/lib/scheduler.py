@@ -0,0 +1,100 @@
+"""
+@description: Playback queue of library clips. Items are played back to back without gaps by
+the in-process player, ordered by priority (an urgent item preempts the one playing), and can
+be cancelled by id. The mood and mouth envelope of each item are sent when it starts playing.
+"""
+
+import uuid
+import threading
+import lib.t2s as t2s
+import lib.envelope as envelope
+import lib.soundmood_control as smc
+
+urgent_priority = 10 # Priority given to {"Urgent": true} items
+
+
+# ----- SCHEDULER -----
+class Scheduler:
+    def __init__(self, player):
+        self.player = player
+        self.items = {} # Id -> item dictionary, for the items still playing or queued
+        self._lock = threading.Lock()
+
+    def submit(self, data):
+        """
+        Queues a library clip.
+
+        body = {"Audio": "Feliz_hola", "Mood": "Feliz", "Priority": 0, "Urgent": false}
+        """
+        if t2s.playback_backend == "cvlc":
+            return {"Status": False, "Description": "The queue needs the in-process player (ROBOT_FACE_PLAYBACK=soundcard)"}
+        audio_file = data.get("Audio")
+        if not audio_file:
+            return {"Status": False, "Description": "'Audio' is required."}
+        try:
+            priority = urgent_priority if data.get("Urgent") else int(data.get("Priority", 0))
+        except (TypeError, ValueError):
+            return {"Status": False, "Description": "'Priority' must be an integer."}
+        mood = data.get("Mood") or audio_file.split("_")[0]
+        if mood not in smc.AVAILABLE_MOODS:
+            mood = None
+
+        samples = t2s.load_samples(audio_file)
+        if samples is None:
+            return {"Status": False, "Description": f"Audio {audio_file} not found or not decodable"}
+        levels = envelope.load_envelope(audio_file)
+
+        item = {"Id": uuid.uuid4().hex[:12], "Audio": audio_file, "Mood": mood, "Priority": priority}
+        with self._lock:
+            self._forget_finished()
+            self.items[item["Id"]] = item
+            position = self.player.submit(audio_file, samples, self._on_start(item, levels), priority, item["Id"])
+        return {"Status": "Ok", "Id": item["Id"], "Position": position}
+
+    @staticmethod
+    def _on_start(item, levels):
+        def on_start(delay):
+            # Called by the player thread when the item's first block is handed to the output
+            if item["Mood"]:
+                smc.set_mood(item["Mood"])
+            if levels is not None:
+                smc.send_envelope(levels, delay)
+        return on_start
+
+    def cancel(self, item_id):
+        with self._lock:
+            playing, _ = self.player.scheduled()
+            was_playing = playing is not None and playing.item_id == item_id
+            if not self.player.cancel(item_id):
+                return {"Status": False, "Description": f"Item {item_id} is not playing nor queued"}
+            self.items.pop(item_id, None)
+        if was_playing and self.player.scheduled()[0] is None:
+            smc.stop_envelope() # Nothing follows the cancelled item
+        return {"Status": "Ok", "Id": item_id}
+
+    def status(self):
+        with self._lock:
+            self._forget_finished()
+            playing, queued = self.player.scheduled()
+            current = None
+            if playing is not None and playing.item_id in self.items:
+                current = dict(self.items[playing.item_id],
+                               Position=round(playing.position / self.player.samplerate, 3),
+                               Duration=round(len(playing.samples) / self.player.samplerate, 3),
+                               Paused=self.player.status()["paused"])
+            return {
+                "Playing": current,
+                "Queued": [self.items[clip.item_id] for clip in queued if clip.item_id in self.items],
+            }
+
+    def _forget_finished(self):
+        playing, queued = self.player.scheduled()
+        alive = {clip.item_id for clip in queued}
+        if playing is not None:
+            alive.add(playing.item_id)
+        for item_id in set(self.items) - alive:
+            del self.items[item_id]
+
+
+# Queue of the face_server process
+queue = Scheduler(t2s.player)
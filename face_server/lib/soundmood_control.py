@@ -1,19 +1,36 @@
 """
 @description: Backend service that manages the phrases audio files (create, delete, list), 
-controls system volume using amixer commands, and sends "mood" updates (like 'Feliz' or 'Triste') 
+controls system volume through the volume service, and sends "mood" updates (like 'Feliz' or 'Triste') 
 to a WebSocket server, to sync with the face visualizer.
 """
 
+import os
 import json
 import asyncio
 import websockets
-import os
 import subprocess
-import re
 import lib.t2s as t2s
+import lib.envelope as envelope
+import lib.pcm_store as pcm_store
+import lib.catalog as catalog
+import lib.loudness as loudness
+import lib.volume as volume
+import lib.metrics as metrics
+from lib.face_link import FaceLink
+from lib.embedded_hub import EmbeddedHub
 
 # Websocket server
 uri = "ws://localhost:8760"
+# "external": face_moods/audioServer.py runs as its own process (default)
+# "embedded": the face hub runs inside this process and commands skip the socket (see embedded_hub.py)
+hub_mode = os.environ.get("ROBOT_FACE_HUB", "external")
+# Persistent connection to the websocket server (or the in-process hub), started by the FastAPI app lifespan
+if hub_mode == "embedded":
+	face_link = EmbeddedHub(os.environ.get("ROBOT_FACE_HUB_LOOPBACK_WAV"))
+else:
+	face_link = FaceLink(uri)
+metrics.registry.gauge("face_link_connected", "1 while connected to the face audio server", lambda: int(face_link.connected))
+metrics.registry.gauge("face_link_queue_depth", "Commands waiting to be sent to the face audio server", lambda: face_link.depth)
 
 # A list of all available moods from your server files.
 # IMPORTANT: AVAILABLE_MOODS ARE DEFINED IN "face_moods/audioServer.py" and "face.html" AS WELL
@@ -38,75 +55,51 @@ def post_audio(data):
 	
 	# 3. Return status for non-test audio based on file creation success
 	if response:
+		pcm_store.store.schedule(data["Mood"] + "_" + data["Name"]) # Decoded PCM sidecar, built in background
+		catalog.store.refresh(data["Mood"] + "_" + data["Name"])
+		loudness.job.request() # Gain and normalized envelope of the new clip
 		return {"Status": True, "Description": "Audio file created/overwritten."}
 	else:
-		return {"Status": False, "Description": "Failed to create audio file. key.json missing or invalid?"}
+		return {"Status": False, "Description": "Failed to create audio file. key.json missing or invalid, or ffmpeg missing?"}
 
 # *** Deletion ***
 def delete_audio(data):
 	# Use the correct key "Name" to pass the audio name to the erase function
+	pcm_store.store.schedule_removal(data["Name"])
+	catalog.store.remove(data["Name"])
 	return t2s.eraseAudio(data["Name"])
 
 # *** List Audios ***
-def get_audios():
-	# Searches for the directory where they're stored
-	base_dir = os.path.dirname(os.path.abspath(__file__))
-	AUDIO_DIR = os.path.join(base_dir, "audios")
-
-    # If the directory does not exist, it's created
-	if not os.path.exists(AUDIO_DIR):
-		try:
-			os.makedirs(AUDIO_DIR)
-		except OSError:
-			return []
-	
-    # Filters and lists all .mp3 files in the directory 
-	audio_files = []
-	for filename in os.listdir(AUDIO_DIR):
-		if filename.find("@Test@") > -1:
-			os.remove(AUDIO_DIR+"/"+filename)
-			print(f"{filename} removed since it is a test audio")
-			continue
-		if filename.endswith(".mp3"):
-			name = filename[:-4]
-			audio_files.append({"Name": name})
-	return audio_files
+def get_audios(mood=None, prefix=None, offset=0, limit=None):
+	"""
+	Lists the library audios from the in-memory catalog (no disk access).
+	Returns (list of {Name, Mood, Duration, Size, Text, Created}, total count before pagination).
+	"""
+	return catalog.store.query(mood, prefix, offset, limit)
 
 
 # ----- VOLUME MANAGEMENT -----
 # *** Set Volume ***
 def set_volume(val):
     """
-    Sets the absolute volume in percentage by passing the string directly to the amixer OS command.
+    Sets the absolute volume in percentage [0, 100]. The level is validated and cached, and
+    rapid calls are coalesced by the volume service (see lib/volume.py).
     """
-    # The string 'val' must contain the percentage
-    os.system("amixer -D pulse sset Master " + val + "%")
-    return {"Status": "Ok", "Volume": val}
+    try:
+        level = volume.control.set(val)
+    except ValueError as e:
+        return {"Status": False, "Description": str(e)}
+    return {"Status": "Ok", "Volume": str(level)}
 
 # *** Get Current Volume ***
 def get_volume():
     """
-    Retrieves the actual system volume level using the amixer command.
+    Returns the cached volume level (read from the mixer at most every few seconds).
     """
     try:
-        # Run amixer command and capture output
-        result = subprocess.run(
-            ['amixer', '-D', 'pulse', 'get', 'Master'],
-            capture_output=True,
-            text=True,
-            check=True
-        )
-        output = result.stdout
-
-        # Use regex to find the volume percentage value, e.g., [90%]
-        match = re.search(r'\[(\d+)%\]', output)
-        
-        if match:
-            # Extract the volume value (e.g., '90')
-            current_volume = match.group(1)
-            
-            # Format the actual volume into the required JSON string
-            return { "Status": True, "Value": int(current_volume) }
+        current_volume = volume.control.get()
+        if current_volume is not None:
+            return { "Status": True, "Value": current_volume }
         else:
             # Handle case where volume percentage couldn't be parsed
             error_data = { "Status": False, "Value": -1 }
@@ -128,7 +121,7 @@ def get_moods():
 	return AVAILABLE_MOODS
 
 
-# *** Send WebSocket Command ***
+# *** Send WebSocket Command (one-shot connection) ***
 async def send_mood(command_type, mood):
 	payload = {"type": command_type, **mood} # JSON payload
 	try:
@@ -139,12 +132,45 @@ async def send_mood(command_type, mood):
 	except Exception as e:
 		print(f"An error occurred: {e}")
 
+# *** Send WebSocket Command ***
+def send_command(command_type, data):
+	"""
+	Queues the command on the persistent face link, or hands it to the embedded hub (returns immediately).
+	Falls back to a one-shot connection when the link is not running (e.g. outside the FastAPI app).
+	"""
+	if face_link.running:
+		face_link.publish({"type": command_type, **data})
+	else:
+		asyncio.run(send_mood(command_type, data))
+
 # *** Set Mood (Wrapper) ***
 def set_mood(mood):
-	asyncio.run(send_mood("mood", {"mood": mood}))
+	send_command("mood", {"mood": mood})
 	return {"Status": "OK", "mood": mood}
 
 # *** Set the mouth state (Wrapper). state = "on", "off" ***
 def set_mouth(state):
-	asyncio.run(send_mood("audio", {"command": state}))
-	return {"Status": "OK", "state": state}
\ No newline at end of file
+	send_command("audio", {"command": state})
+	return {"Status": "OK", "state": state}
+
+# *** Stream the Precomputed Envelope of a Clip ***
+def play_envelope(audio_file, delay=0.0, offset=0.0):
+	"""
+	Sends the stored mouth envelope of 'audio_file' to the audio server, which streams it from
+	'offset' seconds into the clip, 'delay' seconds after reception.
+	Returns False if the clip has no envelope (live loopback is used).
+	"""
+	levels = envelope.load_envelope(audio_file)
+	if levels is None:
+		return False
+	send_envelope(levels, delay, offset)
+	return True
+
+# *** Stream an Envelope ***
+def send_envelope(levels, delay=0.0, offset=0.0):
+	"""Sends envelope levels (uint8 array, one every envelope.HOP seconds) to the audio server."""
+	send_command("envelope", {"hop": envelope.HOP, "delay": delay, "offset": offset, "levels": levels.tolist()})
+
+# *** Stop the Envelope Streaming ***
+def stop_envelope():
+	send_command("envelope", {"command": "stop"})
@@ -0,0 +1,107 @@
+"""
+@description: Speaks arbitrary text without creating a library audio. The text is split into
+sentences that are synthesized in a pipeline; the first sentence starts playing as soon as it
+is ready while the next ones are still being synthesized, and they follow it without gaps.
+"""
+
+import re
+import uuid
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import lib.t2s as t2s
+import lib.decoder as decoder
+import lib.envelope as envelope
+import lib.soundmood_control as smc
+
+# Sentences synthesized at the same time (the first one plus the look-ahead)
+pipeline_depth = 3
+_pool = ThreadPoolExecutor(max_workers=pipeline_depth, thread_name_prefix="speak")
+
+# Splits after the sentence punctuation, keeping it with its sentence
+SENTENCE_END = re.compile(r'(?<=[.!?;…])\s+')
+
+_lock = threading.Lock()
+_current = None # Utterance being spoken
+
+
+# ----- SENTENCES -----
+def split_sentences(text):
+    return [sentence.strip() for sentence in SENTENCE_END.split(text or "") if sentence.strip()]
+
+
+# ----- UTTERANCE -----
+class Utterance:
+    def __init__(self, sentences, mood):
+        self.id = uuid.uuid4().hex[:12]
+        self.sentences = sentences
+        self.mood = mood
+        self.cancelled = threading.Event()
+        self.futures = []
+
+    def cancel(self):
+        self.cancelled.set()
+        for future in self.futures:
+            future.cancel() # Sentences not being synthesized yet are skipped
+
+
+# ----- SPEAK -----
+def speak(data):
+    """
+    Speaks data["Text"] with the optional data["Mood"], replacing the current utterance.
+
+    body = {"Text": "Hola. ¿Cómo estás?", "Mood": "Feliz"}
+    """
+    global _current
+    if t2s.playback_backend == "cvlc":
+        return {"Status": False, "Description": "Speaking needs the in-process player (ROBOT_FACE_PLAYBACK=soundcard)"}
+    sentences = split_sentences(data.get("Text"))
+    if not sentences:
+        return {"Status": False, "Description": "'Text' is empty."}
+
+    utterance = Utterance(sentences, data.get("Mood"))
+    with _lock:
+        if _current is not None:
+            _current.cancel()
+        _current = utterance
+    # Every sentence is submitted at once, the pool bounds how many are synthesized in parallel
+    utterance.futures = [_pool.submit(t2s.synthesize, sentence) for sentence in sentences]
+    threading.Thread(target=_play_sentences, args=(utterance,), name="speak-player", daemon=True).start()
+    return {"Status": "Ok", "Id": utterance.id, "Sentences": len(sentences)}
+
+def cancel():
+    """Stops feeding sentences of the current utterance to the player (e.g. on /audio/stop)."""
+    with _lock:
+        if _current is not None:
+            _current.cancel()
+
+# *** Sentence Player (one thread per utterance) ***
+def _play_sentences(utterance):
+    first = True
+    for index, future in enumerate(utterance.futures):
+        if utterance.cancelled.is_set():
+            return
+        try:
+            key, path_file = future.result()
+        except Exception as e: # Cancelled or failed synthesis
+            print(f"Sentence {index} of {utterance.id} not synthesized: {e}")
+            continue
+        if path_file is None:
+            continue
+        samples = decoder.decode_file(path_file, t2s.player.samplerate)
+        if samples is None:
+            continue
+        levels = envelope.compute_envelope(samples)
+        on_start = lambda delay, levels=levels: smc.send_envelope(levels, delay)
+
+        name = f"speak:{utterance.id}:{index}"
+        with _lock:
+            if utterance.cancelled.is_set():
+                return
+            if first:
+                if utterance.mood in smc.AVAILABLE_MOODS:
+                    smc.set_mood(utterance.mood)
+                smc.set_mouth("on")
+                t2s.player.play(name, samples, on_start)
+                first = False
+            else:
+                t2s.player.enqueue(name, samples, on_start)
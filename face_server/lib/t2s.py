@@ -5,45 +5,242 @@ and controlling audio playback (play/stop) by sending commands to a WebSocket se
 """
 
 import os
-from google.cloud import texttospeech
+import json
+import hashlib
+import shutil
+import threading
+import time
+import io
+import wave
+import numpy as np
 import subprocess
+import signal
+import lib.envelope as envelope
+import lib.clip_meta as clip_meta
+import lib.decoder as decoder
+import lib.pcm_store as pcm_store
+import lib.postprocess as postprocess
+import lib.metrics as metrics
+from collections import OrderedDict
+from lib.player import Player
 
 audios_dir = "lib/audios/"
-subprocess_pointer = None
 
-# ----- CREATE AUDIO FILE -----
-# (Google TTS)
-def createAudio(data):
-    google_key_file = 'lib/data/key.json'
+# --- Playback ---
+# "soundcard" plays decoded PCM in-process, "cvlc" starts a cvlc process per play,
+# "null" plays in-process to a silent stand-in output (benchmarks, no sound card)
+playback_backend = os.environ.get("ROBOT_FACE_PLAYBACK", "soundcard")
+player = Player(output="null" if playback_backend == "null" else "soundcard")
+subprocess_pointers = [] # cvlc processes started by playAudio
+player_start_latency = 0.3 # Seconds cvlc takes to output the first sample of a clip
+
+# --- TTS Parameters ---
+voice_name = "es-US-Wavenet-B" #Voz es-US-Wavenet-C (A, B o C), es-US-Standard-A (A,B o C)
+language_code = "es-US"
+audio_encoding_name = "LINEAR16" # texttospeech.AudioEncoding member (lossless, the MP3 is encoded after the post-processing)
+speaking_rate = 0.9
+pitch = 8
+
+# "google" (Google Cloud TTS) or "fake" (synthetic clips, no network nor key, for offline tests)
+tts_backend = os.environ.get("ROBOT_FACE_TTS", "google")
+fake_tts_latency = float(os.environ.get("ROBOT_FACE_FAKE_TTS_LATENCY", "0.2")) # Seconds per fake request
+
+# Fake clips: 200 Hz tone modulated at a syllable rate, so they move the mouth like speech
+FAKE_SAMPLE_RATE = 22050
+FAKE_SECONDS_PER_CHAR = 0.065
+
+# --- Metrics ---
+tts_latency = metrics.registry.histogram("tts_synthesis_seconds", "TTS backend call time (cache misses)")
+tts_postprocess = metrics.registry.histogram("tts_postprocess_seconds", "Silence trimming, resampling and encoding of a TTS response")
+tts_cache_hits = metrics.registry.counter("tts_cache_hits_total", "Synthesis requests served from the TTS cache")
+tts_failures = metrics.registry.counter("tts_failures_total", "Synthesis requests that failed")
+play_start = metrics.registry.histogram("play_start_seconds", "Play request until its first sample is heard")
+metrics.registry.gauge("player_playing", "1 while the in-process player outputs a clip", lambda: int(player.is_playing))
+
+# --- TTS Cache ---
+# Each synthesized clip is stored once under the hash of its text and TTS parameters,
+# and library files ("Mood_Name.mp3") are hard links to it
+cache_dir = "lib/data/tts_cache/"
+POST_EXT = ".post.json" # Trimmed offsets of a cached clip (see lib/postprocess.py)
+CACHE_EXTS = (".mp3", POST_EXT, envelope.ENVELOPE_EXT) # Files of a cache entry
+# Entries that no library file links to (e.g. /v1/speak sentences) are evicted, least recently
+# used first, beyond this budget (ROBOT_FACE_TTS_CACHE_MB, default 64 MB)
+cache_budget = int(float(os.environ.get("ROBOT_FACE_TTS_CACHE_MB", "64")) * 1024 * 1024)
+cache_min_age = 60.0 # Seconds an entry is kept after its last use (it may be about to play or be linked)
+_cache_lru = None # key -> last use (time.time()), oldest first; loaded from the mtimes on first use
+_cache_lock = threading.Lock()
+google_key_file = 'lib/data/key.json'
+_client = None
+_client_lock = threading.Lock()
+
+
+# ----- TTS CLIENT -----
+def get_client():
+    """Returns the shared TextToSpeechClient, created on first use."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            texttospeech = _texttospeech()
+            _client = texttospeech.TextToSpeechClient() # Instantiates a client
+        return _client
+
+def _texttospeech():
+    """
+    The Google TTS stack (grpc, protobuf) takes seconds to import on the robot, so it is
+    imported on the first synthesis instead of at startup (playback never needs it).
+    """
+    from google.cloud import texttospeech
+    return texttospeech
+
+# ----- TTS CACHE -----
+def cache_key(text):
+    params = [text, tts_backend, voice_name, language_code, speaking_rate, pitch, audio_encoding_name, postprocess.settings()]
+    return hashlib.sha256(json.dumps(params, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+# *** Atomic File Helpers ***
+def _atomic_write(path_file, content):
+    """Writes to a temporary file and renames it, so readers never see a half-written file."""
+    tmp_path = f"{path_file}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as out:
+        out.write(content)
+    os.replace(tmp_path, path_file)
+
+def _atomic_link(src, dst):
+    """Atomically points 'dst' to the content of 'src' (hard link, or copy across filesystems)."""
+    try:
+        if os.path.samefile(src, dst):
+            return # Already linked: rename() would do nothing and leave the temporary link behind
+    except FileNotFoundError:
+        pass
+    tmp_path = f"{dst}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        os.link(src, tmp_path)
+    except OSError:
+        shutil.copyfile(src, tmp_path)
+    os.replace(tmp_path, dst)
+
+# ----- SYNTHESIZE SPEECH -----
+def synthesize(text):
+    """
+    Returns (key, path) of the cached MP3 of 'text', calling the TTS backend only on a cache miss.
+    Returns (key, None) if the speech could not be synthesized.
+    """
+    key = cache_key(text)
+    cached_file = cache_dir + key + ".mp3"
+    if os.path.exists(cached_file):
+        tts_cache_hits.inc()
+        _touch_cache(key)
+        return key, cached_file
+
+    start = time.monotonic()
+    if tts_backend == "fake":
+        audio_content = _synthesize_fake(text)
+    else:
+        audio_content = _synthesize_google(text)
+    if audio_content is None:
+        tts_failures.inc()
+        return key, None
+    tts_latency.observe(time.monotonic() - start)
+
+    # Trimmed and resampled to the device rate once here, instead of on every play
+    start = time.monotonic()
+    audio_content, post_info = postprocess.process(audio_content)
+    tts_postprocess.observe(time.monotonic() - start)
+    if audio_content is None: # Not encoded to MP3: nothing is cached
+        tts_failures.inc()
+        return key, None
+
+    os.makedirs(cache_dir, exist_ok=True)
+    # Written first: a cached MP3 always has its offsets
+    _atomic_write(cache_dir + key + POST_EXT, json.dumps(post_info).encode("utf-8"))
+    _atomic_write(cached_file, audio_content)
+    _touch_cache(key)
+    prune_cache()
+    return key, cached_file
+
+# *** Cache Eviction (LRU) ***
+def _touch_cache(key):
+    """
+    Marks a cache entry as just used. The order is kept in memory: touching the file would also
+    change the library clips hard-linked to it (and trigger the rebuild of their sidecars).
+    """
+    global _cache_lru
+    with _cache_lock:
+        if _cache_lru is None:
+            _cache_lru = _load_cache_lru()
+        _cache_lru[key] = time.time()
+        _cache_lru.move_to_end(key)
+
+def _load_cache_lru():
+    try:
+        entries = [(entry.stat().st_mtime, entry.name[:-4]) for entry in os.scandir(cache_dir) if entry.name.endswith(".mp3")]
+    except FileNotFoundError:
+        entries = []
+    return OrderedDict((key, mtime) for mtime, key in sorted(entries))
+
+def prune_cache():
+    """Evicts the least recently used entries no library file links to, until they fit in 'cache_budget'."""
+    evicted = 0
+    with _cache_lock:
+        unlinked = [] # (key, bytes), least recently used first
+        for key in _cache_lru:
+            try:
+                stat = os.stat(cache_dir + key + ".mp3")
+            except FileNotFoundError:
+                continue
+            if stat.st_nlink == 1: # No "Mood_Name.mp3" points to it
+                unlinked.append((key, stat.st_size))
+        total = sum(size for key, size in unlinked)
+        now = time.time()
+        for key, size in unlinked:
+            if total <= cache_budget:
+                break
+            if now - _cache_lru[key] < cache_min_age:
+                continue
+            for ext in CACHE_EXTS:
+                try:
+                    os.remove(cache_dir + key + ext)
+                except FileNotFoundError:
+                    pass
+            del _cache_lru[key]
+            total -= size
+            evicted += 1
+    if evicted:
+        print(f"TTS cache: {evicted} unused entries evicted")
+
+def cached_post_info(key):
+    """Trimmed offsets and duration of a cached clip ({} if it was not post-processed)."""
+    try:
+        with open(cache_dir + key + POST_EXT, encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
 
+# *** Google TTS Backend ***
+def _synthesize_google(text):
     # *** Verification of the key ***
     if os.path.exists(google_key_file):
         os.environ['GOOGLE_APPLICATION_CREDENTIALS']=google_key_file
     else:
         print("\n--- Error: text to speech Google key file DOES NOT exist ---\n")
-        return False
+        return None
     try:
-        client = texttospeech.TextToSpeechClient() # Instantiates a client
-
-        # *** TTS Parameters ***
-        name="es-US-Wavenet-B" #Voz es-US-Wavenet-C (A, B o C), es-US-Standard-A (A,B o C)
-        language_code="es-US"
-
-        audio_encoding=texttospeech.AudioEncoding.MP3
-        speaking_rate = 0.9
-        pitch = 8
+        texttospeech = _texttospeech()
+        client = get_client()
 
         # *** Sintezise Speech Request ***
-        synthesis_input = texttospeech.SynthesisInput(text=data["Text"])
+        synthesis_input = texttospeech.SynthesisInput(text=text)
 
         # Build the voice request
         voice = texttospeech.VoiceSelectionParams(
-            name=name, language_code=language_code
+            name=voice_name, language_code=language_code
         )
 
         # Select the type of audio file you want returned
         audio_config = texttospeech.AudioConfig(
-            audio_encoding=audio_encoding, speaking_rate = speaking_rate, pitch = pitch
+            audio_encoding=getattr(texttospeech.AudioEncoding, audio_encoding_name),
+            sample_rate_hertz=decoder.DEVICE_SAMPLE_RATE, # Synthesized at the device rate, no resampling
+            speaking_rate = speaking_rate, pitch = pitch
         )
 
         # Perform the text-to-speech request
@@ -52,11 +249,54 @@ def createAudio(data):
         )
     except:
         print("********* ERROR: Invalid Google Key for text-to-speech")
+        return None
+
+    return response.audio_content
+
+# *** Fake TTS Backend (offline tests) ***
+def _synthesize_fake(text):
+    """
+    Speech-like clip whose duration grows with the text length, returned after 'fake_tts_latency'
+    seconds. The data is WAV (ffmpeg and cvlc detect it even with the .mp3 extension).
+    """
+    time.sleep(fake_tts_latency)
+    t = np.arange(int(max(len(text), 1) * FAKE_SECONDS_PER_CHAR * FAKE_SAMPLE_RATE)) / FAKE_SAMPLE_RATE
+    signal_wave = 0.5 * np.sin(2 * np.pi * 200 * t) * np.abs(np.sin(2 * np.pi * 4 * t))
+    out = io.BytesIO()
+    with wave.open(out, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(FAKE_SAMPLE_RATE)
+        wav.writeframes((signal_wave * 32767).astype(np.int16).tobytes())
+    return out.getvalue()
+
+# ----- CREATE AUDIO FILE -----
+def createAudio(data):
+    key, cached_file = synthesize(data["Text"])
+    if cached_file is None:
         return False
 
-    # Save to the static directory
-    with open(audios_dir + data["Mood"] + "_" + data["Name"] + ".mp3", "wb") as out: 
-        out.write(response.audio_content) # Write the response to the output file.
+    # Clip metadata, replaced as a whole since the previous values belong to the previous audio
+    audio_file = data["Mood"] + "_" + data["Name"]
+    meta = {"Mood": data["Mood"], "Text": data["Text"], "Created": time.time(), "Key": key}
+    meta.update(cached_post_info(key)) # TrimStart, TrimEnd (seconds removed by the post-processing) and Duration
+    clip_meta.save_meta(audio_file, meta)
+
+    # Link into the static directory (atomic, safe while the previous version is playing)
+    path_file = audios_dir + audio_file + ".mp3"
+    # The mtime is not touched: the inode is shared with the cache entry and the other clips linked
+    # to it. The sidecars of this clip are stale anyway, they were stamped from the previous MP3
+    _atomic_link(cached_file, path_file)
+
+    # Precompute the mouth envelope, so the clip does not need live loopback analysis
+    cached_envelope = cache_dir + key + envelope.ENVELOPE_EXT
+    if not os.path.exists(cached_envelope):
+        if not envelope.build_envelope(audio_file):
+            print(f"Envelope not created for {audio_file}, live loopback analysis will be used")
+            return True
+        _atomic_link(envelope.envelope_path(audio_file), cached_envelope)
+    else:
+        _atomic_link(cached_envelope, envelope.envelope_path(audio_file))
 
     return True
 
@@ -66,21 +306,91 @@ def eraseAudio(Name):
         os.remove(audios_dir + Name + ".mp3") # Delete from the static directory
     except FileNotFoundError as e:
         print(e)
+    envelope.erase_envelope(Name)
+    clip_meta.erase_meta(Name)
     return {"Status" : "Deleted"}
 
-# ----- Play Audio (via WebSocket) -----
-def playAudio(audio_file):
-    global subprocess_pointer
+# ----- Play Audio -----
+def playAudio(audio_file, on_start=None):
+    """
+    Plays a library clip with the configured backend. 'on_start(delay)' is called once the
+    clip is handed to the output, with the delay (s) until its first sample is heard.
+    """
+    path_file = audios_dir + audio_file + ".mp3"
+    if not os.path.exists(path_file):
+        return {"Status": False, "Description": f"Audio {audio_file} not found"}
+    on_start = _timed_start(on_start)
+
+    if playback_backend == "cvlc":
+        return _play_cvlc(path_file, on_start)
+
+    samples = load_samples(audio_file)
+    if samples is None:
+        return {"Status": False, "Description": f"Audio {audio_file} could not be decoded"}
+    player.play(audio_file, samples, on_start)
+    return {"Status": "Ok", "audio": "playing"}
+
+def play_samples(audio_file, samples, on_start=None):
+    """Plays samples already loaded (e.g. preloaded by a timeline) with the in-process player."""
+    player.play(audio_file, samples, _timed_start(on_start))
+    return {"Status": "Ok", "audio": "playing"}
+
+def _timed_start(on_start):
+    """Wraps 'on_start' to record the play-start latency (request -> first sample heard)."""
+    requested = time.monotonic()
+    def started(delay):
+        play_start.observe(time.monotonic() - requested + delay)
+        if on_start is not None:
+            on_start(delay)
+    return started
+
+def load_samples(audio_file, count=True):
+    """Samples of a library clip for the in-process player, None if it cannot be decoded ('count': see PcmStore.get)."""
     path_file = audios_dir + audio_file + ".mp3"
-    cmd = ["cvlc","--fullscreen","--noloop","--no-video-title-show","--video-on-top",path_file]
+    if not os.path.exists(path_file):
+        return None
+    # Memory-mapped PCM sidecar, decoded only if the sidecar is not built yet
+    samples = pcm_store.store.get(audio_file, count)
+    if samples is None:
+        samples = decoder.decode_file(path_file, player.samplerate)
+    return samples
+
+# *** cvlc Backend ***
+def _play_cvlc(path_file, on_start=None):
+    cmd = ["cvlc","--fullscreen","--noloop","--no-video-title-show","--video-on-top","--play-and-exit",path_file]
     
-    subprocess_pt = subprocess.Popen(cmd, stdout=subprocess.PIPE)
-    subprocess_pointer = subprocess_pt
+    subprocess_pointers.append(subprocess.Popen(cmd, stdout=subprocess.PIPE))
+    if on_start is not None:
+        on_start(player_start_latency)
     return {"Status": "Ok", "audio": "playing"}
 
-# ----- Pause Audio (via WebSocket) -----
+def _cvlc_players():
+    """Returns the cvlc processes still running (finished ones are forgotten)."""
+    subprocess_pointers[:] = [process for process in subprocess_pointers if process.poll() is None]
+    return subprocess_pointers
+
+# ----- Stop Audio -----
 def stop():
-    global subprocess_pointer
-    if subprocess_pointer is not None:
-        subprocess_pointer.kill()
-    return {"Status": "Ok", "audio": "stopped"}
\ No newline at end of file
+    player.stop()
+    for process in _cvlc_players(): # Every overlapping cvlc player, not only the last one
+        process.kill()
+    return {"Status": "Ok", "audio": "stopped"}
+
+# ----- Pause / Resume Audio -----
+def pause():
+    player.pause()
+    for process in _cvlc_players():
+        process.send_signal(signal.SIGSTOP)
+    return {"Status": "Ok", "audio": "paused"}
+
+def resume():
+    player.resume()
+    for process in _cvlc_players():
+        process.send_signal(signal.SIGCONT)
+    return {"Status": "Ok", "audio": "playing"}
+
+# ----- Playback Status -----
+def status():
+    if playback_backend == "cvlc":
+        return {"playing": len(_cvlc_players()) > 0, "backend": "cvlc"}
+    return {**player.status(), "backend": playback_backend}
@@ -0,0 +1,240 @@
+"""
+@description: Timed choreographies. A timeline is a list of timestamped actions (mood, mouth
+on/off, play a library clip, volume) validated on upload and executed by a dedicated thread
+against the monotonic clock: it sleeps until just before each action and spins the last
+millisecond, so actions fire within a fraction of a millisecond of their time and the timing
+does not drift over loops. Timelines can be looped and cancelled by id.
+"""
+
+import time
+import uuid
+import threading
+import numpy as np
+from collections import OrderedDict
+import lib.t2s as t2s
+import lib.volume as volume
+import lib.catalog as catalog
+import lib.metrics as metrics
+import lib.soundmood_control as smc
+
+ACTIONS = ("mood", "mouth", "play", "volume")
+max_actions = 1000
+max_timelines = 50 # Finished timelines kept for the status endpoint
+spin_time = 0.001  # Seconds before an action when the thread stops sleeping and spins
+
+lateness = metrics.registry.histogram("timeline_lateness_seconds", "Time between the scheduled and the actual start of a timeline action",
+                                      buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.05, 0.1))
+
+timelines = OrderedDict() # timeline_id -> Timeline
+_lock = threading.Lock()
+
+
+# ----- VALIDATION -----
+def parse_action(index, action):
+    """Returns the normalized action, or raises ValueError with the reason."""
+    if not isinstance(action, dict):
+        raise ValueError(f"Action {index} must be an object")
+    try:
+        at = float(action.get("At"))
+    except (TypeError, ValueError):
+        raise ValueError(f"Action {index}: 'At' (seconds from the start) is required")
+    if at < 0:
+        raise ValueError(f"Action {index}: 'At' must be >= 0")
+    kind = action.get("Action")
+    if kind not in ACTIONS:
+        raise ValueError(f"Action {index}: 'Action' must be one of {', '.join(ACTIONS)}")
+
+    parsed = {"At": at, "Action": kind}
+    if kind == "mood":
+        if action.get("Mood") not in smc.AVAILABLE_MOODS:
+            raise ValueError(f"Action {index}: unknown mood {action.get('Mood')}")
+        parsed["Mood"] = action["Mood"]
+    elif kind == "mouth":
+        if action.get("State") not in ("on", "off"):
+            raise ValueError(f"Action {index}: 'State' must be on or off")
+        parsed["State"] = action["State"]
+    elif kind == "play":
+        audio_file = action.get("Audio")
+        if audio_file not in catalog.store.entries:
+            raise ValueError(f"Action {index}: audio {audio_file} is not in the library")
+        parsed["Audio"] = audio_file
+        parsed["Duration"] = catalog.store.entries[audio_file].get("Duration") or 0.0
+    elif kind == "volume":
+        try:
+            parsed["Value"] = volume.parse_level(action.get("Value"))
+        except ValueError as e:
+            raise ValueError(f"Action {index}: {e}")
+    return parsed
+
+
+# ----- TIMELINE -----
+class Timeline:
+    def __init__(self, actions, period, loops):
+        self.id = uuid.uuid4().hex[:12]
+        self.actions = actions # Sorted by time
+        self.period = period   # Seconds between two iterations
+        self.loops = loops     # Iterations to run (None = until cancelled)
+        self.state = "Running"
+        self.iteration = 0
+        self.executed = 0
+        self.late_max = 0.0
+        self.late_total = 0.0
+        self.heard_max = None # Worst delay until the first sample of a clip is heard
+        self.errors = []
+        self.start = None
+        self._cancel = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"timeline-{self.id}", daemon=True)
+
+    def begin(self, delay=0.0):
+        self.start = time.monotonic() + delay
+        self._thread.start()
+
+    def cancel(self):
+        self._cancel.set()
+
+    # *** Execution Thread ***
+    def _run(self):
+        while self.loops is None or self.iteration < self.loops:
+            origin = self.start + self.iteration * self.period # Fixed grid: no drift across loops
+            for action in self.actions:
+                if not self._wait_until(origin + action["At"]):
+                    self.state = "Cancelled"
+                    return
+                late = time.monotonic() - (origin + action["At"])
+                self._execute(action, origin + action["At"])
+                lateness.observe(late)
+                self.executed += 1
+                self.late_total += late
+                self.late_max = max(self.late_max, late)
+            self.iteration += 1
+            if self.loops is None or self.iteration < self.loops:
+                if not self._wait_until(self.start + self.iteration * self.period):
+                    self.state = "Cancelled"
+                    return
+        self.state = "Finished"
+
+    def _wait_until(self, deadline):
+        """Sleeps (interruptible by cancel) then spins until 'deadline'. False if cancelled."""
+        remaining = deadline - time.monotonic() - spin_time
+        if remaining > 0 and self._cancel.wait(remaining):
+            return False
+        while time.monotonic() < deadline:
+            pass
+        return not self._cancel.is_set()
+
+    def _execute(self, action, due):
+        kind = action["Action"]
+        try:
+            if kind == "mood":
+                smc.set_mood(action["Mood"])
+            elif kind == "mouth":
+                smc.set_mouth(action["State"])
+            elif kind == "volume":
+                smc.set_volume(action["Value"])
+            elif kind == "play":
+                audio_file = action["Audio"]
+                def on_start(delay):
+                    heard = time.monotonic() + delay - due
+                    self.heard_max = heard if self.heard_max is None else max(self.heard_max, heard)
+                    smc.play_envelope(audio_file, delay)
+                if action.get("Samples") is not None: # Preloaded: the play only reads memory
+                    response = t2s.play_samples(audio_file, action["Samples"], on_start)
+                else: # cvlc backend
+                    response = t2s.playAudio(audio_file, on_start=on_start)
+                if not response.get("Status"):
+                    raise RuntimeError(response.get("Description"))
+        except Exception as e:
+            if len(self.errors) < 20:
+                self.errors.append({"At": action["At"], "Action": kind, "Error": str(e)})
+
+    def status(self):
+        return {
+            "Id": self.id,
+            "State": self.state,
+            "Iteration": self.iteration,
+            "Loops": self.loops,
+            "Period": round(self.period, 3),
+            "Actions": len(self.actions),
+            "Executed": self.executed,
+            "LateMs": {
+                "Mean": round(self.late_total / self.executed * 1000, 3) if self.executed else None,
+                "Max": round(self.late_max * 1000, 3),
+                "HeardMax": round(self.heard_max * 1000, 3) if self.heard_max is not None else None,
+            },
+            "Errors": self.errors,
+        }
+
+
+# ----- TIMELINE REGISTRY -----
+def start_timeline(data):
+    """
+    Validates and starts a timeline.
+
+    data = {"Actions": [{"At": 0.0, "Action": "mood", "Mood": "Feliz"},
+                        {"At": 0.5, "Action": "play", "Audio": "Feliz_Saludo"},
+                        {"At": 3.0, "Action": "mouth", "State": "off"},
+                        {"At": 3.0, "Action": "volume", "Value": 60}],
+            "Loop": false, "Period": 5.0, "Delay": 0.0}
+    'Loop' is false (once), true (until cancelled) or a number of iterations; 'Period' (seconds
+    between iterations) defaults to the end of the last action, clips included.
+    """
+    actions = data.get("Actions")
+    if not isinstance(actions, list) or not actions:
+        return {"Status": False, "Description": "'Actions' must be a non-empty list of {At, Action, ...}."}
+    if len(actions) > max_actions:
+        return {"Status": False, "Description": f"A timeline has at most {max_actions} actions."}
+    try:
+        actions = sorted((parse_action(index, action) for index, action in enumerate(actions)), key=lambda action: action["At"])
+        loop = data.get("Loop", False)
+        loops = None if loop is True else 1 if loop is False else int(loop)
+        if loops is not None and loops < 1:
+            raise ValueError("'Loop' must be true, false or a number of iterations >= 1")
+        end = max(action["At"] + action.get("Duration", 0.0) for action in actions)
+        period = float(data.get("Period", end))
+        if loops != 1 and (period <= 0 or period < actions[-1]["At"]):
+            raise ValueError("A looped timeline needs a 'Period' > 0 and not shorter than its last action")
+        delay = max(float(data.get("Delay", 0.0)), 0.0)
+    except (TypeError, ValueError) as e:
+        return {"Status": False, "Description": str(e)}
+
+    # Load the clips into RAM now (decoded or copied out of their memory-mapped sidecar) and keep
+    # them on the actions, so playing them at their time only reads memory
+    if t2s.playback_backend != "cvlc":
+        preloaded = {}
+        for action in actions:
+            if action["Action"] != "play":
+                continue
+            audio_file = action["Audio"]
+            if audio_file not in preloaded:
+                samples = t2s.load_samples(audio_file, count=False)
+                if samples is None:
+                    return {"Status": False, "Description": f"Audio {audio_file} could not be decoded"}
+                preloaded[audio_file] = np.array(samples)
+            action["Samples"] = preloaded[audio_file]
+
+    timeline = Timeline(actions, period, loops)
+    with _lock:
+        timelines[timeline.id] = timeline
+        while len(timelines) > max_timelines: # Forget the oldest finished timelines
+            oldest = next(iter(timelines.values()))
+            if oldest.state == "Running":
+                break
+            timelines.popitem(last=False)
+    timeline.begin(delay)
+    return {"Status": True, "Id": timeline.id, "Actions": len(actions), "Period": round(period, 3), "Loops": loops}
+
+def get_timeline(timeline_id):
+    timeline = timelines.get(timeline_id)
+    if timeline is None:
+        return {"Status": False, "Description": f"Timeline {timeline_id} not found"}
+    return timeline.status()
+
+def cancel_timeline(timeline_id, stop_audio=False):
+    timeline = timelines.get(timeline_id)
+    if timeline is None:
+        return {"Status": False, "Description": f"Timeline {timeline_id} not found"}
+    timeline.cancel()
+    if stop_audio:
+        smc.stop_envelope()
+        t2s.stop()
+    return {"Status": True, "Id": timeline_id}
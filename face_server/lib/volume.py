@@ -0,0 +1,137 @@
+"""
+@description: Volume service. The current level is cached in memory, rapid set requests (e.g. a
+slider) are coalesced so only the latest one is applied, and the mixer is driven through one
+persistent "amixer -s" process instead of one shell per call. In "software" mode the mixer is
+left untouched and the level is applied as a smooth gain ramp by the in-process player.
+"""
+
+import os
+import re
+import time
+import threading
+import subprocess
+import lib.t2s as t2s
+
+# "mixer" (ALSA/PulseAudio Master through amixer) or "software" (gain ramp in the player)
+volume_mode = os.environ.get("ROBOT_FACE_VOLUME_MODE", "mixer")
+mixer_device = "pulse"
+mixer_control = "Master"
+refresh_interval = 5.0 # Seconds a cached mixer level is trusted (the level may be changed outside the API)
+gain_ramp = 0.05 # Seconds of the software gain ramp (avoids clicks)
+
+VOLUME_PATTERN = re.compile(r'\[(\d{1,3})%\]')
+
+
+# ----- VALIDATION -----
+def parse_level(value):
+    """Returns the level as an int in [0, 100] or raises ValueError (no raw string reaches the mixer)."""
+    try:
+        level = int(str(value).strip().rstrip("%"))
+    except ValueError:
+        raise ValueError(f"Volume must be an integer in [0, 100], got '{value}'")
+    if not 0 <= level <= 100:
+        raise ValueError(f"Volume must be in [0, 100], got {level}")
+    return level
+
+
+# ----- MIXER BACKEND -----
+class AmixerBackend:
+    """Persistent 'amixer -s' process reading one command per line from its stdin."""
+
+    def __init__(self, device, control):
+        self.device = device
+        self.control = control
+        self._process = None
+
+    def _ensure_process(self):
+        if self._process is None or self._process.poll() is not None:
+            self._process = subprocess.Popen(
+                ["amixer", "-D", self.device, "-s", "-q"],
+                stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, text=True
+            )
+        return self._process
+
+    def write(self, level):
+        for attempt in range(2): # A dead process (e.g. PulseAudio restart) is started again once
+            process = self._ensure_process()
+            try:
+                process.stdin.write(f"sset {self.control} {level}%\n")
+                process.stdin.flush()
+                return
+            except (BrokenPipeError, OSError):
+                self._process = None
+                if attempt:
+                    raise
+
+    def read(self):
+        """Level read from the mixer (one short-lived process), None if it cannot be parsed."""
+        result = subprocess.run(
+            ["amixer", "-D", self.device, "get", self.control],
+            capture_output=True, text=True, check=True
+        )
+        match = VOLUME_PATTERN.search(result.stdout)
+        return int(match.group(1)) if match else None
+
+
+# ----- VOLUME CONTROL -----
+class VolumeControl:
+    def __init__(self, mode=volume_mode, backend=None, player=None):
+        self.mode = mode
+        self.backend = backend or AmixerBackend(mixer_device, mixer_control)
+        self.player = player # Used in "software" mode
+        self.level = 100 if mode == "software" else None # Cached level
+        self.applied = 0 # Levels written to the mixer (coalesced requests are not counted)
+        self._read_at = 0.0
+        self._pending = None # Latest requested level not yet written to the mixer
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def set(self, value):
+        """Caches the level and applies it asynchronously. Raises ValueError on invalid values."""
+        level = parse_level(value)
+        with self._cond:
+            self.level = level
+            self._read_at = time.monotonic()
+            if self.mode == "software":
+                self.player.set_gain(level / 100, gain_ramp)
+                return level
+            self._pending = level
+            self._cond.notify()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="volume-writer", daemon=True)
+                self._thread.start()
+        return level
+
+    def get(self):
+        """Cached level, read again from the mixer once it is older than 'refresh_interval'."""
+        with self._cond:
+            if self.mode == "software" or self._pending is not None:
+                return self.level
+            if self.level is not None and time.monotonic() - self._read_at < refresh_interval:
+                return self.level
+        level = self.backend.read()
+        with self._cond:
+            if self._pending is None and level is not None: # A set made meanwhile wins
+                self.level = level
+                self._read_at = time.monotonic()
+            return self.level
+
+    # *** Mixer Writer (volume thread) ***
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._pending is None:
+                    self._cond.wait()
+                level = self._pending
+            try:
+                self.backend.write(level)
+                self.applied += 1
+            except Exception as e:
+                print(f"Could not set system volume: {e}")
+            with self._cond:
+                if self._pending == level: # Otherwise a newer level arrived while writing
+                    self._pending = None
+
+
+# Volume of the face_server process
+control = VolumeControl(player=t2s.player)